@@ -0,0 +1,5 @@
+"""Benchmarks of oyster on seeded random causal diagrams.
+
+    python -m benchmarks run --sizes 10,100,1000 --output results.json
+    python -m benchmarks compare before.json results.json
+    python benchmarks/import_time.py"""
@@ -0,0 +1,53 @@
+"""Run the benchmarks, or compare two results files.
+
+    python -m benchmarks run [--sizes 10,100,1000] [--output results.json] ...
+    python -m benchmarks compare old.json new.json [--tolerance 0.25]"""
+
+import argparse
+import sys
+from benchmarks.generators import GENERATORS
+from benchmarks.suite import BENCHMARKS, SIZES, run, report, save, load, compare
+
+def _names(choices):
+    def parse(text):
+        names = text.split(',')
+        unknown = set(names) - set(choices)
+        if unknown: raise argparse.ArgumentTypeError(f'unknown: {", ".join(sorted(unknown))}')
+        return names
+    return parse
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command')
+    runner = commands.add_parser('run', help='run the benchmarks')
+    runner.add_argument('--benchmarks', type=_names(BENCHMARKS), help=', '.join(BENCHMARKS))
+    runner.add_argument('--generators', type=_names(GENERATORS), help=', '.join(GENERATORS))
+    runner.add_argument('--sizes', type=lambda text: [int(n) for n in text.split(',')], 
+                        default=SIZES)
+    runner.add_argument('--repeat', type=int, default=3)
+    runner.add_argument('--limit', type=float, default=10.0, 
+                        help='seconds after which larger sizes are skipped')
+    runner.add_argument('--seed', type=int, default=0)
+    runner.add_argument('--no-memory', action='store_true', help='skip the tracemalloc runs')
+    runner.add_argument('--output', help='write the results to this JSON file')
+    comparer = commands.add_parser('compare', help='compare two results files')
+    comparer.add_argument('old')
+    comparer.add_argument('new')
+    comparer.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        results = run(args.benchmarks, args.generators, args.sizes, args.repeat, 
+                      args.limit, not args.no_memory, args.seed)
+        print(report(results))
+        if args.output: save(results, args.output)
+    elif args.command == 'compare':
+        ratios, regressions = compare(load(args.old), load(args.new), args.tolerance)
+        for benchmark, generator, n, ratio in ratios:
+            flag = '  REGRESSION' if ratio > 1 + args.tolerance else ''
+            print(f'{benchmark:<30} {generator:<12} n={n:<7} {ratio:6.2f}x{flag}')
+        if regressions: sys.exit(1)
+    else: parser.print_help()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Seeded random causal diagrams for benchmarks.
+
+Every generator takes the number of nodes n and a seed, runs in time
+linear in the size of the diagram, and returns a CausalDiagram whose
+observed nodes are named V0, V1, ... and latent confounders U0, U1, ..."""
+
+import math
+import random
+from oyster.diagram import CausalDiagram
+
+
+def _diagram(n, edges, rng):
+    """A CausalDiagram on n nodes and edges between node numbers, with the
+    names shuffled so that the order of the names is not a topological order."""
+    names = [f'V{i}' for i in range(n)]
+    rng.shuffle(names)
+    G = CausalDiagram()
+    G.add_nodes_from(names)
+    G.add_edges_from((names[u], names[v]) for u, v in edges)
+    return G
+
+def erdos_renyi_dag(n, degree=2.0, seed=0):
+    """A DAG on n nodes joining each pair of nodes, in a random order, with
+    probability degree / (n - 1), so that nodes have degree neighbors on
+    average. Pairs are skipped geometrically (Batagelj and Brandes 2005)."""
+    rng = random.Random(seed)
+    p = min(1.0, degree / (n - 1)) if n > 1 else 0.0
+    if p == 1.0: return _diagram(n, ((u, v) for v in range(n) for u in range(v)), rng)
+    edges, v, u = [], 1, -1
+    while p > 0 and v < n:
+        u += 1 + int(math.log(1 - rng.random()) / math.log(1 - p))
+        while u >= v and v < n:
+            u, v = u - v, v + 1
+        if v < n: edges.append((u, v))
+    return _diagram(n, edges, rng)
+
+def scale_free_dag(n, m=2, seed=0):
+    """A DAG grown by preferential attachment (Barabási and Albert 1999):
+    each new node gets m parents among the earlier nodes, chosen with
+    probability proportional to their degree, so a few hubs are causes
+    of many nodes."""
+    rng = random.Random(seed)
+    edges, weighted = [], list(range(min(m, n)))
+    for v in range(min(m, n), n):
+        parents = set()
+        while len(parents) < min(m, v): parents.add(rng.choice(weighted))
+        edges.extend((u, v) for u in parents)
+        weighted.extend(parents)
+        weighted.extend([v] * len(parents))
+    return _diagram(n, edges, rng)
+
+def layered_dag(n, layers=None, degree=2, seed=0):
+    """A DAG of n nodes in layers (about √n of them by default), where each
+    node has degree parents in the layer before its own."""
+    rng = random.Random(seed)
+    layers = max(1, min(n, layers or round(math.sqrt(n))))
+    bounds = [n * k // layers for k in range(layers + 1)]
+    edges = []
+    for k in range(1, layers):
+        previous = range(bounds[k - 1], bounds[k])
+        for v in range(bounds[k], bounds[k + 1]):
+            edges.extend((u, v) for u in rng.sample(previous, min(degree, len(previous))))
+    return _diagram(n, edges, rng)
+
+def confounded_dag(n, latents=None, seed=0, base=erdos_renyi_dag, **parameters):
+    """A base DAG on n observed nodes (Erdős–Rényi by default, given the
+    other keyword parameters) with latent confounders (n // 10 by default),
+    each a hidden parent of two observed nodes."""
+    G = base(n, seed=seed, **parameters)
+    rng = random.Random(seed)
+    observed = list(G)
+    latents = n // 10 if latents is None else latents
+    if n < 2: return G
+    G.add_edges_from(((f'U{i}', v) for i in range(latents) for v in rng.sample(observed, 2)),
+                     hidden=True)
+    return G
+
+GENERATORS = {'erdos_renyi': erdos_renyi_dag, 'scale_free': scale_free_dag,
+              'layered': layered_dag, 'confounded': confounded_dag}
@@ -0,0 +1,47 @@
+"""Time `import oyster` in fresh interpreters and check which heavy
+modules it loads.
+
+    python benchmarks/import_time.py [--repeat 5] [--max-ms 1000]
+
+Exits with status 1 if the median import time exceeds --max-ms or if
+importing oyster loads matplotlib."""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ('matplotlib', 'matplotlib.pyplot', 'oyster.viz.viz', 'oyster.example.graphs')
+CODE = f'''import sys, time
+start = time.perf_counter()
+import oyster
+print((time.perf_counter() - start) * 1000)
+print(' '.join(m for m in {HEAVY} if m in sys.modules))'''
+
+def import_time():
+    """Return the milliseconds to import oyster in a fresh interpreter, 
+    and the heavy modules it loaded."""
+    output = subprocess.run([sys.executable, '-c', CODE], cwd=ROOT, check=True,
+                            stdout=subprocess.PIPE, universal_newlines=True).stdout
+    ms, loaded = (output.splitlines() + [''])[:2]
+    return float(ms), loaded.split()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--max-ms', type=float, default=None)
+    args = parser.parse_args()
+    times, loaded = [], set()
+    for _ in range(args.repeat):
+        ms, modules = import_time()
+        times.append(ms)
+        loaded.update(modules)
+    median = statistics.median(times)
+    print(f'import oyster: median {median:.0f} ms, min {min(times):.0f} ms over {args.repeat} runs')
+    if loaded: print(f'loaded: {", ".join(sorted(loaded))}')
+    if loaded or args.max_ms is not None and median > args.max_ms: sys.exit(1)
+
+if __name__ == '__main__':
+    main()
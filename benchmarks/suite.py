@@ -0,0 +1,177 @@
+"""Time oyster's analyses on random diagrams of growing size.
+
+Each benchmark runs on every generator at every size, timing the best of
+a few runs and recording the peak memory of one run under tracemalloc.
+Once a benchmark takes longer than the time limit on a generator, or its
+scaling so far predicts that the next size would, the larger sizes are
+skipped: that is where the function stops being usable."""
+
+import json
+import math
+import platform
+import random
+import subprocess
+import time
+import tracemalloc
+from collections import namedtuple
+from datetime import datetime, timezone
+from itertools import islice
+from oyster.adjust import d_separated, backdoor_criterion_search, backdoor_adjustment_sets
+from oyster.equivalence import dag_to_cpdag
+from oyster.identify import is_identifiable
+from oyster.instruments import instrumental_variable_search
+from oyster.oyster import iter_implied_independencies
+from oyster.structures import c_components
+from oyster.utils.graph_utils import An, Pa, observable_nodes
+from oyster.utils.search import Budget
+from benchmarks.generators import GENERATORS
+
+SIZES = (10, 100, 1000, 10000, 100000)
+MAX_RESULTS = 10 # Searches list at most this many sets
+
+Case = namedtuple('Case', ['G', 'X', 'Y', 'Z'])
+Case.__doc__ = """A diagram and a query on it: treatment X, outcome Y and
+the observed parents Z of Y other than X."""
+
+def case(G, seed=0):
+    """Pick a query on G: an outcome Y with an observed ancestor X."""
+    rng = random.Random(seed)
+    observed = sorted(observable_nodes(G))
+    for _ in range(100):
+        Y = rng.choice(observed)
+        ancestors = sorted(An(G, Y) & set(observed))
+        if ancestors: break
+    X = rng.choice(ancestors) if ancestors else rng.choice([v for v in observed if v != Y])
+    return Case(G, X, Y, (Pa(G, Y) & set(observed)) - {X})
+
+# Searches get a Budget with the time limit and at most MAX_RESULTS results.
+BENCHMARKS = {
+    'd_separated': lambda c, budget: d_separated(c.G, c.X, c.Y, c.Z),
+    'backdoor_criterion_search': lambda c, budget: 
+        backdoor_criterion_search(c.G, c.X, c.Y, budget=budget),
+    'minimal_adjustment_sets': lambda c, budget: # minimal_adjustment_sets, within budget
+        list(backdoor_adjustment_sets(c.G, c.X, c.Y, budget=budget)),
+    'is_identifiable': lambda c, budget: is_identifiable(c.G, c.X, c.Y),
+    'c_components': lambda c, budget: c_components(c.G),
+    'dag_to_cpdag': lambda c, budget: dag_to_cpdag(c.G),
+    'instrumental_variable_search': lambda c, budget: 
+        instrumental_variable_search(c.G, c.X, c.Y, budget=budget),
+    'implied_independencies': lambda c, budget: # The first MAX_RESULTS pairs
+        list(islice(iter_implied_independencies(c.G, max_separators=1), MAX_RESULTS)),
+}
+
+def measure(benchmark, c, repeat=3, limit=10.0, memory=True):
+    """Return the best time in seconds of benchmark on case c, its peak
+    memory in bytes (None if memory=False), and if the budget of a search
+    ran out. Caches are cleared before every run, and runs stop once their
+    total exceeds limit."""
+    function, times = BENCHMARKS[benchmark], []
+    for _ in range(repeat):
+        c.G.clear_cache()
+        budget = Budget(max_results=MAX_RESULTS, timeout=limit)
+        start = time.perf_counter()
+        function(c, budget)
+        times.append(time.perf_counter() - start)
+        if sum(times) > limit: break
+    peak = None
+    if memory:
+        c.G.clear_cache()
+        tracemalloc.start()
+        try: function(c, Budget(max_results=MAX_RESULTS, timeout=limit))
+        finally: peak = tracemalloc.get_traced_memory()[1]; tracemalloc.stop()
+    return min(times), peak, budget.truncated
+
+def exponent(points):
+    """The exponent k of the scaling time ~ n^k between the last two
+    (n, seconds) points, or None with fewer than two."""
+    if len(points) < 2: return None
+    (n1, t1), (n2, t2) = points[-2:]
+    if n1 == n2 or t1 <= 0 or t2 <= 0: return None
+    return math.log(t2 / t1) / math.log(n2 / n1)
+
+def run(benchmarks=None, generators=None, sizes=SIZES, repeat=3, limit=10.0, 
+        memory=True, seed=0, log=print):
+    """Run the benchmarks and return a list of results, one dict per
+    (benchmark, generator, n) with its status: 'ok', 'error' or 'skipped'."""
+    benchmarks = list(benchmarks or BENCHMARKS)
+    generators = list(generators or GENERATORS)
+    results, points, stopped = [], {}, set()
+    for generator in generators:
+        for n in sorted(sizes):
+            G, c = None, None
+            for benchmark in benchmarks:
+                key = (benchmark, generator)
+                result = {'benchmark': benchmark, 'generator': generator, 'n': n}
+                curve = points.setdefault(key, [])
+                k = exponent(curve)
+                predicted = curve and curve[-1][1] * (n / curve[-1][0]) ** max(1.0, k or 1.0)
+                if key in stopped or predicted and predicted > limit:
+                    stopped.add(key)
+                    results.append(dict(result, status='skipped'))
+                    continue
+                if G is None:
+                    G = GENERATORS[generator](n, seed=seed)
+                    c = case(G, seed)
+                result['edges'] = G.number_of_edges()
+                try: seconds, peak, truncated = measure(benchmark, c, repeat, limit, memory)
+                except Exception as error: # Record failures and go on
+                    stopped.add(key)
+                    results.append(dict(result, status='error', error=repr(error)))
+                    continue
+                curve.append((n, seconds))
+                results.append(dict(result, status='ok', seconds=seconds, peak_bytes=peak,
+                                    truncated=truncated))
+                if seconds > limit: stopped.add(key)
+                if log: log(f'{benchmark:<30} {generator:<12} n={n:<7} {_ms(seconds)}')
+    return results
+
+def _ms(seconds): return f'{seconds * 1000:10.2f} ms'
+
+def report(results):
+    """Return the scaling curves of results as text: the time of each
+    benchmark on each generator by size (with * if its search was cut
+    short by the budget), and the exponent of its growth."""
+    lines, curves = [], {}
+    for r in results:
+        curves.setdefault((r['benchmark'], r['generator']), []).append(r)
+    for (benchmark, generator), rows in curves.items():
+        cells = [f"{r['n']}: " + (_ms(r['seconds']).strip() + '*' * r['truncated']
+                                  if r['status'] == 'ok' else r['status']) for r in rows]
+        k = exponent([(r['n'], r['seconds']) for r in rows if r['status'] == 'ok'])
+        growth = f'  ~n^{k:.1f}' if k is not None else ''
+        peak = max((r['peak_bytes'] or 0 for r in rows if r['status'] == 'ok'), default=0)
+        lines.append(f'{benchmark} on {generator}{growth}, peak {peak / 2**20:.1f} MiB')
+        lines.append('    ' + ', '.join(cells))
+    return '\n'.join(lines)
+
+
+### Results files ###
+def metadata():
+    """The commit, Python and platform the results were measured on."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], stdout=subprocess.PIPE, 
+                                stderr=subprocess.DEVNULL, universal_newlines=True).stdout.strip()
+    except OSError: commit = ''
+    return {'commit': commit or None, 'python': platform.python_version(),
+            'platform': platform.platform(), 
+            'time': datetime.now(timezone.utc).isoformat(timespec='seconds')}
+
+def save(results, path):
+    """Write results and their metadata to a JSON file."""
+    with open(path, 'w') as f:
+        json.dump({'metadata': metadata(), 'results': results}, f, indent=1)
+
+def load(path):
+    """Return the results in a JSON file written by save."""
+    with open(path) as f: return json.load(f)['results']
+
+def compare(old, new, tolerance=0.25):
+    """Return (benchmark, generator, n, ratio) for the results measured in
+    both old and new, with ratio the new time over the old, and the list of
+    those slower by more than tolerance (regressions)."""
+    before = {(r['benchmark'], r['generator'], r['n']): r for r in old if r['status'] == 'ok'}
+    ratios = [(r['benchmark'], r['generator'], r['n'], 
+               r['seconds'] / before[key]['seconds'] if before[key]['seconds'] else 1.0)
+              for r in new for key in [(r['benchmark'], r['generator'], r['n'])] 
+              if r['status'] == 'ok' and key in before]
+    return ratios, [ratio for ratio in ratios if ratio[3] > 1 + tolerance]
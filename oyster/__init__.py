@@ -1,12 +1,40 @@
+import sys
+from importlib import import_module
 from oyster.oyster import *
 from oyster.adjust import *
-from oyster.diagram import CausalDiagram
+from oyster.diagram import CausalDiagram, FrozenCausalDiagram
 from oyster.structures import *
 from oyster.instruments import *
 from oyster.identify import *
 from oyster.utils.graph_utils import *
 from oyster.utils.set_utils import *
-import oyster.example.graphs as ex
-from oyster.viz.viz import *
-from oyster.viz.formulas import *
-from oyster.equivalence import dag_to_cpdag, equivalence_class_size
\ No newline at end of file
+from oyster.utils.search import Budget, SearchResult
+from oyster.utils.profiling import profile, Profile
+from oyster.equivalence import (dag_to_cpdag, equivalence_class_size, cpdag_size,
+                                equivalent_dags, sample_dag, consistent_extension)
+from oyster.batch import analyze, pair_queries, Query
+from oyster.surgery import surgery, Surgery
+from oyster.io import (from_dagitty, to_dagitty, from_dot, to_dot, read_csv, write_csv,
+                       read_binary, write_binary)
+
+# Plotting, the example graphs and the formulas load on first use, so that
+# importing oyster does not import matplotlib.
+_LAZY = {'ex': ('oyster.example.graphs', None)}
+_LAZY.update((name, ('oyster.viz.viz', name)) for name in 
+             ('print_path', 'print_paths', 'draw', 'd_sep_graphs', 'draw_cpdag', 'gv_draw'))
+_LAZY.update((name, ('oyster.viz.formulas', name)) for name in 
+             ('joint_factorization', 'backdoor_adjustment_formula', 'frontdoor_adjustment_formula',
+              'specific_adjustment_formula', 'val', 'tjoin', 'P', 'product', 'joint', 'pa'))
+
+def __getattr__(name):
+    if name not in _LAZY: raise AttributeError(f"module 'oyster' has no attribute {name!r}")
+    module, attribute = _LAZY[name]
+    value = import_module(module)
+    if attribute is not None: value = getattr(value, attribute)
+    globals()[name] = value
+    return value
+
+def __dir__(): return sorted(set(globals()) | set(_LAZY))
+
+if sys.version_info < (3, 7): # No module __getattr__ (PEP 562): load everything
+    for _name in _LAZY: globals()[_name] = __getattr__(_name)
@@ -1,26 +1,148 @@
 """Functions for determining d-separation and adjustment sets."""
 
 import networkx as nx
-from oyster.utils.set_utils import powerset, minimal_sets, _set 
-from oyster.utils.graph_utils import An, De, Pa, Ch, ancestral_graph, moral_graph, backdoor_graph
+from itertools import islice
+from oyster.utils.set_utils import _set
+from oyster.utils.search import Budget, search
+from oyster.utils.profiling import instrumented
+from oyster.identify import is_identifiable_single_x
+from oyster.equivalence import consistent_extension
+from oyster.surgery import surgery
+from oyster.diagram import FrozenCausalDiagram
+from oyster.utils.graph_utils import (An, De, Pa, Ch, backdoor_graph, moral_graph, 
+                                      ancestral_graph, minimal_vertex_separators, 
+                                      proper_causal_nodes, proper_backdoor_graph, _cached)
 
-# TODO: powerset search is probably prohibitive for moderately-sized graphs, might need to sized bsed on some number
 
 ### D-separation ###
+def _reachable(DAG, X, Z):
+    """Return the nodes reachable from X along active trails given Z.
+    
+    The 'Reachable' (Bayes-Ball) procedure from Koller and Friedman 2009,
+    Algorithm 3.1: one pass over (node, direction) pairs, O(|V|+|E|).
+    In an ADMG a bidirected edge is a hidden parent of both its ends, so
+    trails pass it wherever they could go up to a parent (m-separation)."""
+    X, Z = _set(X), _set(Z)
+    # Phase I: Z and all of its ancestors (colliders that are open)
+    A, stack = set(Z), list(Z)
+    while stack:
+        for p in DAG.pred[stack.pop()]:
+            if p not in A:
+                A.add(p)
+                stack.append(p)
+    # Phase II: traverse active trails. UP means we arrived from a child, 
+    # DOWN means we arrived from a parent.
+    UP, DOWN = 0, 1
+    bidirected = DAG.graph.get('bidirected', {})
+    def spouses(node): return ((v, DOWN) for v in bidirected.get(node, ()) if v in DAG)
+    visited, reachable = set(), set()
+    stack = [(x, UP) for x in X]
+    while stack:
+        node, direction = stack.pop()
+        if (node, direction) in visited: continue
+        visited.add((node, direction))
+        if node not in Z: reachable.add(node)
+        if direction == UP and node not in Z:
+            stack.extend((p, UP) for p in DAG.pred[node])
+            stack.extend(spouses(node))
+            stack.extend((c, DOWN) for c in DAG.succ[node])
+        elif direction == DOWN:
+            if node not in Z:
+                stack.extend((c, DOWN) for c in DAG.succ[node])
+            if node in A:
+                stack.extend((p, UP) for p in DAG.pred[node])
+                stack.extend(spouses(node))
+    return reachable
+
+def _dag(G):
+    """Return G, or a DAG in its equivalence class if G is a CPDAG, which
+    has the same d-separations (an edge both ways is a reversible edge).
+    
+    G is a CPDAG if G.graph['cpdag'] is set, as by dag_to_cpdag and 
+    from_dagitty, and its extension is cached (see consistent_extension)."""
+    return consistent_extension(G) if G.graph.get('cpdag') else G
+
+def _active(G, X, Z):
+    """The nodes reachable from X along active trails given Z in the DAG,
+    CPDAG or ADMG G, cached by a CausalDiagram."""
+    X, Z = frozenset(_set(X)), frozenset(_set(Z))
+    if isinstance(G, FrozenCausalDiagram): reachable = G.reachable
+    else: reachable = lambda X, Z: _reachable(_dag(G), X, Z)
+    return _cached(G, ('reachable', X, Z), lambda: frozenset(reachable(X, Z)))
+
+@instrumented
 def d_separated(DAG, X, Y, Z):
-    """Return if Z d-separates X and Y in the DAG."""
-    X, Y, Z = _set(X), _set(Y), _set(Z)
-    ancestral = ancestral_graph(DAG, X|Y|Z) # Take ancestral graph of nodes in question..
-    moral = moral_graph(ancestral) # Moralize & disorient...
-    moral_without_givens = moral.subgraph(moral.nodes - Z) # Remove givens...
-    # Any paths between X and Y?
-    return not any([nx.has_path(moral_without_givens, x, y) 
-                    for x in X for y in Y])
+    """Return if Z d-separates X and Y in the DAG or CPDAG, or m-separates
+    them in the ADMG."""
+    return not _active(DAG, X, Z) & _set(Y)
+
+def d_connected_nodes(DAG, X, Z):
+    """Return the set of all nodes d-connected to X given Z in the DAG or CPDAG."""
+    return set(_active(DAG, X, Z) - _set(X))
+
+
+
+### Separator Enumeration ###
+def find_separator(DAG, X, Y, I=set(), R=None):
+    """Return a set Z with I ⊆ Z ⊆ R that d-separates X and Y in DAG, 
+    or None if there is no such set.
+    
+    From van der Zander et al. 2019: if any such separator exists, 
+    then An(X ∪ Y ∪ I) ∩ R is one."""
+    X, Y, I = _set(X), _set(Y), _set(I)
+    R = DAG.nodes - X - Y if R is None else _set(R) - X - Y
+    if not I <= R: return None
+    Z = (An(DAG, X|Y|I) | I) & R
+    return Z if d_separated(DAG, X, Y, Z) else None
+
+@instrumented
+def separators(DAG, X, Y, I=set(), R=None, minimal=False, budget=None):
+    """Generate the sets Z with I ⊆ Z ⊆ R that d-separate X and Y in DAG.
+    
+    With minimal=True only the separators that are minimal relative to I
+    are listed, as minimal vertex separators in the moral graph of 
+    An(X ∪ Y ∪ I). Otherwise all separators are listed by ListSep 
+    (van der Zander et al. 2019). Both have polynomial delay. Stops when 
+    the Budget (if given) runs out, and skips sets over its max_set_size."""
+    X, Y, I = _set(X), _set(Y), _set(I)
+    R = DAG.nodes - X - Y if R is None else _set(R) - X - Y
+    budget = Budget() if budget is None else budget
+    if not budget.spend() or find_separator(DAG, X, Y, I, R) is None: return
+    if minimal:
+        moral = moral_graph(ancestral_graph(DAG, X|Y|I))
+        moral = moral.subgraph(moral.nodes - I)
+        for Z in minimal_vertex_separators(moral, X, Y, allowed=R - I):
+            if not budget.spend(): return
+            if budget.fits(Z | I): yield Z | I
+        return
+    # ListSep: branch on each undecided node, excluding it first so that 
+    # every separator is listed after its subsets.
+    stack = [(I, R)]
+    while stack:
+        I, R = stack.pop()
+        if not budget.fits(I): continue
+        if not budget.spend(): return
+        if find_separator(DAG, X, Y, I, R) is None: continue
+        if I == R: 
+            yield set(I)
+            continue
+        v = next(iter(R - I))
+        stack.append((I | {v}, R))
+        stack.append((I, R - {v}))
 
-def d_separator_search(DAG, X, Y):
-    """Return d_separators for X and Y in DAG."""
-    return [set(z) for z in powerset(DAG.nodes - _set(X) - _set(Y))
-            if d_separated(DAG, X, Y, z)]
+
+def d_separator_search(DAG, X, Y, budget=None, lazy=False):
+    """Return d_separators for X and Y in DAG.
+    
+    Like the other searches, returns a SearchResult, a list that is 
+    truncated if the Budget (if given) ran out first, or with lazy=True 
+    a generator of the results."""
+    return search(separators(DAG, X, Y, budget=budget), budget, lazy)
+
+def minimal_d_separators(DAG, X, Y, max_results=None, budget=None):
+    """Return the minimal d-separators for X and Y in DAG, 
+    at most max_results of them if given."""
+    return list(islice(separators(DAG, X, Y, minimal=True, budget=budget), max_results))
 
 
 ### Back-Door Criterion ###
@@ -32,11 +154,23 @@ def meets_backdoor_criterion(DAG, X, Y, Z):
         # ii) Z d-separates all backdoor paths between X and Y
         d_separated(backdoor_graph(DAG, X), X, Y, Z)))
 
-def backdoor_criterion_search(DAG, X, Y):
+@instrumented
+def backdoor_adjustment_sets(DAG, X, Y, minimal=True, include=set(), exclude=set(),
+                             budget=None):
+    """Generate the sets of nodes satisfying the backdoor criterion 
+    from X to Y in DAG that contain include and avoid exclude.
+    
+    Lists the minimal sets (relative to include), or all sets if 
+    minimal=False, lazily and with polynomial delay, within budget."""
+    X, Y = _set(X), _set(Y)
+    possible_nodes = DAG.nodes - De(DAG, X) - X - Y - _set(exclude)
+    return separators(backdoor_graph(DAG, X), X, Y, I=include, R=possible_nodes, 
+                      minimal=minimal, budget=budget)
+
+def backdoor_criterion_search(DAG, X, Y, budget=None, lazy=False):
     """Return all sets of nodes satisfying the backdoor criterion from X to Y in DAG."""
-    possible_nodes = DAG.nodes() - De(DAG, X) - _set(X) - _set(Y)
-    return [set(z) for z in powerset(possible_nodes)
-            if meets_backdoor_criterion(DAG, X, Y, z)]
+    return search(backdoor_adjustment_sets(DAG, X, Y, minimal=False, budget=budget), 
+                  budget, lazy)
 
 
 ### Front-Door Criterion ###
@@ -50,31 +184,209 @@ def meets_frontdoor_criterion(DAG, X, Y, Z):
         # iii) All backdoor paths from Z to Y are blocked by X
         d_separated(backdoor_graph(DAG, Z), Z, Y, X)))
 
-def frontdoor_criterion_search(DAG, X, Y):
-    """Return all sets of nodes that satisfy the backdoor criterion from X to Y in DAG."""
-    return [set(Z) for Z in powerset(DAG.nodes - _set(X) - _set(Y)) 
-            if meets_frontdoor_criterion(DAG, X, Y, Z)]
+def _intercepts(DAG, X, Y, Z):
+    """Return if Z intercepts all directed paths from X to Y in DAG."""
+    seen, stack = set(X), list(X)
+    while stack:
+        for c in DAG.succ[stack.pop()]:
+            if c in Y: return False
+            if c not in seen and c not in Z:
+                seen.add(c)
+                stack.append(c)
+    return True
+
+def find_frontdoor_set(DAG, X, Y, I=set(), R=None):
+    """Return a set Z with I ⊆ Z ⊆ R satisfying the frontdoor criterion 
+    for X on Y in DAG, or None if there is no such set.
+    
+    From Jeong, Tian and Bareinboim 2022: the nodes of R with no open 
+    backdoor path from X, less those with open backdoor paths to Y given 
+    X, contain every set meeting criteria ii) and iii). So if any such 
+    set exists, then that largest candidate is one."""
+    X, Y, I = _set(X), _set(Y), _set(I)
+    R = DAG.nodes - X - Y if R is None else _set(R) - X - Y
+    G = surgery(DAG)
+    # ii) Drop the nodes with an open backdoor path from X
+    Z = R - d_connected_nodes(G.backdoor(X), X, set())
+    # iii) Drop the nodes with an open backdoor path to Y given X. Dropping
+    # a node restores its outgoing edges, so repeat until none are left.
+    while True:
+        connected = Z & d_connected_nodes(G.backdoor(Z), Y, X)
+        if not connected: break
+        Z -= connected
+    # i) Larger sets intercept more directed paths
+    if not I <= Z or not _intercepts(DAG, X, Y, Z): return None
+    return Z
+
+def _frontdoor_relevant(DAG, X, Y, I, R):
+    """Return the nodes of R that can belong to a frontdoor set for X on Y
+    that is minimal relative to I.
+    
+    Each such node is in I, on a directed path from X to Y, or else on an
+    active path given X from another such node to Y."""
+    relevant = I | De(DAG, X) & An(DAG, Y) & R
+    to_Y = d_connected_nodes(DAG, Y, X) & R
+    while True:
+        new = to_Y & d_connected_nodes(DAG, relevant, X) - relevant
+        if not new: return relevant
+        relevant |= new
+
+@instrumented
+def frontdoor_adjustment_sets(DAG, X, Y, minimal=True, include=set(), exclude=set(),
+                              budget=None):
+    """Generate the sets of nodes satisfying the frontdoor criterion 
+    from X to Y in DAG that contain include and avoid exclude.
+    
+    Branches on one node at a time (ListFDSets, Jeong, Tian and Bareinboim 
+    2022), excluding it first so that every set is listed after its 
+    subsets. With minimal=False every set is listed with polynomial delay.
+    With minimal=True only the sets minimal relative to include are 
+    listed, and branches that contain one already listed are pruned, but
+    the other branches may hold only non-minimal sets, so the delay 
+    between two sets can be exponential. Stops when the Budget (if given)
+    runs out, and skips sets over its max_set_size."""
+    X, Y, include = _set(X), _set(Y), _set(include)
+    budget = Budget() if budget is None else budget
+    R = DAG.nodes - X - Y - _set(exclude)
+    if minimal: R &= _frontdoor_relevant(DAG, X, Y, include, R)
+    found = []
+    stack = [(include, R)]
+    while stack:
+        I, R = stack.pop()
+        if minimal and any(F <= I for F in found) or not budget.fits(I): continue
+        if not budget.spend(): return
+        Z = find_frontdoor_set(DAG, X, Y, I, R)
+        if Z is None: continue
+        R = Z # Nodes outside the largest candidate are never in a set
+        if I == R:
+            found.append(I)
+            yield set(I)
+            continue
+        v = next(iter(R - I))
+        stack.append((I | {v}, R))
+        stack.append((I, R - {v}))
+
+def frontdoor_criterion_search(DAG, X, Y, budget=None, lazy=False):
+    """Return all sets of nodes that satisfy the frontdoor criterion from X to Y in DAG."""
+    return search(frontdoor_adjustment_sets(DAG, X, Y, minimal=False, budget=budget), 
+                  budget, lazy)
+
+
+### Adjustment Criterion ###
+# The generalized adjustment criterion in the form of Perković et al. 2018, 
+# for DAGs and CPDAGs: Z is an adjustment set for X on Y if the graph is 
+# amenable, Z avoids the forbidden nodes and Z d-separates X and Y in the 
+# proper backdoor graph of a DAG in the class. In a CPDAG, paths follow 
+# reversible edges either way, so causal paths are possibly causal paths.
+def is_amenable(G, X, Y):
+    """Return if every proper possibly causal path from X to Y in the DAG 
+    or CPDAG G starts with a directed edge, which is needed for any set to 
+    be an adjustment set in every DAG of the class (Perković et al. 2017)."""
+    causal = proper_causal_nodes(G, X, Y)
+    return not any(u in G.pred[x] and u in causal 
+                   for x in _set(X) for u in G.succ[x])
+
+def forbidden_nodes(G, X, Y):
+    """Return X and the nodes on or (possibly) descended from proper 
+    (possibly) causal paths from X to Y in the DAG or CPDAG G, which no 
+    adjustment set may contain."""
+    causal = proper_causal_nodes(G, X, Y)
+    return causal | De(G, causal) | _set(X)
+
+def meets_adjustment_criterion(G, X, Y, Z):
+    """Return if Z satisfies the adjustment criterion for X on Y in the 
+    DAG or CPDAG G."""
+    return all((
+        # i) Every proper possibly causal path starts with a directed edge
+        is_amenable(G, X, Y),
+        # ii) No node in Z is forbidden
+        not forbidden_nodes(G, X, Y) & _set(Z),
+        # iii) Z d-separates X and Y once proper causal paths are cut
+        d_separated(proper_backdoor_graph(_dag(G), X, Y), X, Y, Z)))
+
+def _moral_boundary(DAG, A, X, Z):
+    """Return the nodes of Z adjacent to the component of X in the moral 
+    graph of the ancestral set A with Z removed, without moralizing: 
+    the parents of each child are visited once."""
+    reached, boundary, married = set(X), set(), set()
+    stack = list(X)
+    def visit(v):
+        if v in Z: boundary.add(v)
+        elif v not in reached:
+            reached.add(v)
+            stack.append(v)
+    while stack:
+        v = stack.pop()
+        for p in DAG.pred[v]: visit(p)
+        for c in DAG.succ[v]:
+            if c not in A: continue
+            visit(c)
+            if c not in married:
+                married.add(c)
+                for p in DAG.pred[c]: visit(p)
+    return boundary
+
+def _minimal_separator(DAG, X, Y, I, Z):
+    """Return a subset of the separator Z of X and Y in DAG that is a 
+    minimal separator relative to I (van der Zander et al. 2019)."""
+    A = An(DAG, X|Y|I) | X|Y|I
+    Z = _moral_boundary(DAG, A, X, Z & A) | I
+    return _moral_boundary(DAG, A, Y, Z) | I
+
+def adjustment_set(G, X, Y, include=set(), exclude=set(), minimal=False):
+    """Return an adjustment set for X on Y in the DAG or CPDAG G that 
+    contains include and avoids exclude, or None if there is no such set 
+    (for every DAG in the class), in O(|V|+|E|).
+    
+    Returns the canonical set, An(X ∪ Y ∪ include) in a DAG of the class 
+    less the forbidden and excluded nodes, which is an adjustment set 
+    whenever any is, or with minimal=True a subset of it that is minimal 
+    relative to include."""
+    X, Y, I = _set(X), _set(Y), _set(include)
+    if not is_amenable(G, X, Y): return None
+    pbd = proper_backdoor_graph(_dag(G), X, Y)
+    R = G.nodes - forbidden_nodes(G, X, Y) - _set(exclude)
+    Z = find_separator(pbd, X, Y, I, R)
+    if Z is None or not minimal: return Z
+    return _minimal_separator(pbd, X, Y, I, Z)
+
+def optimal_adjustment_set(G, X, Y, exclude=set(), minimal=False):
+    """Return the optimal adjustment set for X on Y in the DAG or CPDAG G, 
+    or None if it is not an adjustment set or contains an excluded node, 
+    in O(|V|+|E|).
+    
+    The O-set of Henckel, Perković and Maathuis 2022, the parents of the 
+    nodes on proper causal paths less the forbidden nodes, gives the least 
+    asymptotic variance among adjustment sets for estimating the effect, 
+    and is one whenever any is and Y descends from X. With minimal=True 
+    return a minimal subset of it that is still an adjustment set."""
+    X, Y = _set(X), _set(Y)
+    if not is_amenable(G, X, Y): return None
+    parents = {p for v in proper_causal_nodes(G, X, Y) 
+               for p in G.pred[v] if v not in G.pred[p]}
+    O = parents - forbidden_nodes(G, X, Y) - Y
+    pbd = proper_backdoor_graph(_dag(G), X, Y)
+    if O & _set(exclude) or not d_separated(pbd, X, Y, O): return None
+    return _minimal_separator(pbd, X, Y, set(), O) if minimal else O
 
 
 ### Adjusters
 def minimal_adjustment_sets(DAG, X, Y):
     """Return the minimal sets of nodes that meet the backdoor criterion for X on Y in DAG."""
-    return minimal_sets(backdoor_criterion_search(DAG, X, Y))
+    return list(backdoor_adjustment_sets(DAG, X, Y))
 
 def specific_adjustment_sets(DAG, X, Y, Z):
     """Return minimal sets of variables including Z that meet the backdoor criterion (z-specific effects)."""
-    return [s for s in backdoor_criterion_search(DAG, X, Y) if Z in s]
+    return list(backdoor_adjustment_sets(DAG, X, Y, minimal=False, include=Z))
 
+@instrumented
 def adjusters(G,X,Y, exclude=[]):
     """Return the minimal sets of adjusters capable of 
     determining the causal effect of X on Y in the causal
     model specified by DAG."""
-    def no_excludeds(adj_set): return not set(exclude) & adj_set
-    iden = identifiable_single_X(G, X, Y)
-    bd_sets = [set(S) for S in backdoor_criterion_search(G, X, Y) 
-               if no_excludeds(S)]
-    fd_sets = [set(S) for S in frontdoor_criterion_search(G, X, Y) 
-               if no_excludeds(S)]
+    iden = is_identifiable_single_x(G, X, Y)
+    bd_sets = list(backdoor_adjustment_sets(G, X, Y, minimal=False, exclude=exclude))
+    fd_sets = list(frontdoor_adjustment_sets(G, X, Y, minimal=False, exclude=exclude))
     
     adj = {
         'identifiable': iden,
@@ -0,0 +1,102 @@
+"""Batch analysis of many (X, Y) queries on one causal diagram."""
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import islice, permutations
+from oyster.adjust import minimal_adjustment_sets, adjusters
+from oyster.identify import Identifier
+from oyster.utils.graph_utils import observable_nodes
+from oyster.utils.set_utils import _set
+
+Query = namedtuple('Query', ['kind', 'X', 'Y'])
+Query.__doc__ = """A batch query: the analysis kind (a key of QUERIES)
+and its treatment and outcome variables."""
+
+
+class Analysis:
+    """Answers queries on one diagram, sharing precomputed structures.
+
+    The diagram's reachability index (ancestors, descendants, parents,
+    children) is built once, and a single Identifier shares its latent
+    projection, c-components and ID subproblems across identification
+    queries. Answers are cached, so repeated queries are free."""
+    def __init__(self, G):
+        self.G = G.copy()
+        if hasattr(self.G, 'build_index'): self.G.build_index()
+        self._identifier = None
+        self._results = {}
+
+    @property
+    def identifier(self):
+        if self._identifier is None: self._identifier = Identifier(self.G)
+        return self._identifier
+
+    def answer(self, query):
+        """Return the answer to a Query."""
+        kind, X, Y = query
+        key = (kind, frozenset(_set(X)), frozenset(_set(Y)))
+        if key not in self._results:
+            self._results[key] = QUERIES[kind](self, X, Y)
+        return self._results[key]
+
+QUERIES = {
+    'identifiable': lambda A, X, Y: A.identifier.identify(X, Y),
+    'estimand': lambda A, X, Y: A.identifier.identify(X, Y, estimand=True),
+    'minimal_adjustment_sets': lambda A, X, Y: minimal_adjustment_sets(A.G, X, Y),
+    'adjusters': lambda A, X, Y: adjusters(A.G, X, Y),
+}
+
+
+def pair_queries(G, kinds=('identifiable',), pairs=None):
+    """Return Queries of each kind for pairs of nodes in G, by default
+    every ordered pair of distinct observable nodes."""
+    if pairs is None: pairs = permutations(sorted(observable_nodes(G), key=str), 2)
+    return [Query(kind, X, Y) for X, Y in pairs for kind in kinds]
+
+# Worker processes hold one Analysis, built from the diagram they are
+# shipped once at startup.
+_analysis = None
+
+def _start_worker(G):
+    global _analysis
+    _analysis = Analysis(G)
+
+def _answer_chunk(queries):
+    return [(query, _analysis.answer(query)) for query in queries]
+
+def _chunks(queries, size):
+    queries = iter(queries)
+    chunk = list(islice(queries, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(queries, size))
+
+def analyze(G, queries, processes=None, chunksize=1):
+    """Generate (query, answer) for each Query on the causal diagram G.
+
+    Queries are answered by a pool of processes (by default one per CPU),
+    each sent the diagram once, and answers are generated as they finish,
+    so not in the order of queries. With processes=0 or 1, queries are
+    answered in order in this process. Queries may be (kind, X, Y) tuples,
+    where kind is a key of QUERIES; an unknown kind raises a ValueError 
+    when analyze is called."""
+    queries = [Query(*query) for query in queries]
+    for query in queries:
+        if query.kind not in QUERIES: raise ValueError(f'Unknown query kind {query.kind!r}')
+    return _analyze(G, queries, processes, chunksize)
+
+def _analyze(G, queries, processes, chunksize):
+    """Generate (query, answer) for each of the validated queries."""
+    if processes in (0, 1):
+        analysis = Analysis(G)
+        for query in queries: yield query, analysis.answer(query)
+        return
+    with ProcessPoolExecutor(processes, initializer=_start_worker,
+                             initargs=(G,)) as pool:
+        futures = [pool.submit(_answer_chunk, chunk)
+                   for chunk in _chunks(queries, chunksize)]
+        try:
+            for future in as_completed(futures):
+                yield from future.result()
+        finally:
+            for future in futures: future.cancel()
@@ -1,6 +1,379 @@
 import networkx as nx
+from array import array
+from collections import OrderedDict, namedtuple
+from collections.abc import Mapping, Set
+from functools import wraps
+from itertools import combinations
+from oyster.utils.set_utils import _set
+from oyster.utils.reachability import ReachabilityIndex
+
+class CacheInfo(namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])):
+    """Statistics of a diagram's cache, like functools.lru_cache's."""
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+def _mutates(method):
+    """Wrap a graph mutator so that it counts a new version of the graph
+    and drops any reachability index and cached results."""
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        self._version += 1
+        self._reachability = None
+        self._cache.clear()
+        return method(self, *args, **kwargs)
+    return wrapper
 
 class CausalDiagram(nx.DiGraph):
-    def __init__(self, incoming_graph_data=None, **attr):
-        super().__init__(incoming_graph_data, *attr)
-        assert nx.is_directed_acyclic_graph(self), "Input data is not acyclic!"
\ No newline at end of file
+    """A causal DAG that caches derived results (d-separations, selector
+    results, subgraph views, moral graphs) in a bounded LRU cache.
+
+    Every node or edge change counts a new version and clears the cache.
+    Changes to node, edge or graph attributes are not tracked: call
+    clear_cache() after them. Subgraph views of a diagram keep their own
+    caches, which are cleared when the diagram changes."""
+    def __init__(self, incoming_graph_data=None, cache_size=1024, **attr):
+        self._version = 0
+        self._reachability = None
+        self._cache = OrderedDict()
+        self._cache_version = 0
+        self.cache_size = cache_size
+        self._hits = self._misses = 0
+        super().__init__(incoming_graph_data, **attr)
+        assert nx.is_directed_acyclic_graph(self), "Input data is not acyclic!"
+
+    def build_index(self):
+        """Precompute a ReachabilityIndex used by the node selectors
+        (An, De, Pa, Ch, MB) until the diagram is next mutated."""
+        self._reachability = ReachabilityIndex(self)
+        return self._reachability
+
+    def project_latents(self):
+        """Return the ADMG of this diagram, with hidden nodes projected
+        into bidirected edges (see graph_utils.latent_projection)."""
+        from oyster.utils.graph_utils import latent_projection
+        return latent_projection(self)
+
+    # Caching
+    @property
+    def version(self):
+        """The number of changes to the nodes and edges of the diagram."""
+        return self._root()._version
+
+    def _root(self):
+        """The diagram that this one is a (nested) subgraph view of, or itself."""
+        G = self
+        while getattr(G, '_graph', None) is not None: G = G._graph
+        return G
+
+    def cached(self, key, compute):
+        """Return the result cached under key, computing and caching it
+        with compute() if it is not cached."""
+        root = self._root()
+        version = root._version
+        if version != self._cache_version:
+            self._cache.clear()
+            self._cache_version = version
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            root._hits += 1
+            return self._cache[key]
+        root._misses += 1
+        value = self._cache[key] = compute()
+        if len(self._cache) > self.cache_size: self._cache.popitem(last=False)
+        return value
+
+    def cache_info(self):
+        """Return the CacheInfo of this diagram, with hits and misses 
+        counted across its subgraph views."""
+        root = self._root()
+        return CacheInfo(root._hits, root._misses, self.cache_size, len(self._cache))
+
+    def clear_cache(self):
+        """Drop all cached results, here and in subgraph views, and reset
+        the statistics."""
+        root = self._root()
+        root._version += 1
+        root._cache.clear()
+        root._hits = root._misses = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy() # Cached views can't be pickled
+        state['_cache'] = OrderedDict()
+        return state
+
+    add_node = _mutates(nx.DiGraph.add_node)
+    add_nodes_from = _mutates(nx.DiGraph.add_nodes_from)
+    remove_node = _mutates(nx.DiGraph.remove_node)
+    remove_nodes_from = _mutates(nx.DiGraph.remove_nodes_from)
+    add_edge = _mutates(nx.DiGraph.add_edge)
+    add_edges_from = _mutates(nx.DiGraph.add_edges_from)
+    remove_edge = _mutates(nx.DiGraph.remove_edge)
+    remove_edges_from = _mutates(nx.DiGraph.remove_edges_from)
+    clear = _mutates(nx.DiGraph.clear)
+    clear_edges = _mutates(nx.DiGraph.clear_edges)
+
+    def freeze(self):
+        """Return this diagram compiled into a FrozenCausalDiagram."""
+        return FrozenCausalDiagram(self)
+
+
+class _Nodes(Set):
+    """The nodes of a FrozenCausalDiagram, like DAG.nodes."""
+    __slots__ = ('diagram',)
+    def __init__(self, diagram): self.diagram = diagram
+    @classmethod
+    def _from_iterable(cls, iterable): return set(iterable)
+    def __contains__(self, node): return node in self.diagram.ids
+    def __iter__(self): return iter(self.diagram.names)
+    def __len__(self): return len(self.diagram.names)
+    def __call__(self, data=False):
+        if not data: return self
+        hidden = self.diagram.hidden
+        return [(v, {'hidden': True} if hidden[i] else {}) 
+                for i, v in enumerate(self.diagram.names)]
+
+class _Edges(list):
+    """The edges of a FrozenCausalDiagram, like DAG.edges."""
+    def __call__(self, data=False):
+        return [(u, v, {}) for u, v in self] if data else self
+
+class _Adjacency(Mapping):
+    """The parents or children of each node of a FrozenCausalDiagram,
+    like DAG.pred or DAG.succ."""
+    __slots__ = ('diagram', 'ptr', 'idx', 'edge')
+    def __init__(self, diagram, ptr, idx, edge=None):
+        self.diagram, self.ptr, self.idx, self.edge = diagram, ptr, idx, edge
+    def __getitem__(self, node):
+        D = self.diagram
+        return [D.names[j] for j in D._adjacent(D.ids[node], self.ptr, self.idx, self.edge)]
+    def __iter__(self): return iter(self.diagram.names)
+    def __len__(self): return len(self.diagram.names)
+
+class FrozenCausalDiagram:
+    """An immutable causal DAG compiled into integer arrays: parents and
+    children in compressed sparse row (CSR) form, node names in a table
+    with node ids in topological order, and a mask of hidden nodes.
+
+    It has the pred, succ, nodes and edges of a graph, so d-separation,
+    the node selectors, c-components and the adjustment criteria run on
+    it directly, with native traversals of the arrays for reachability
+    and selectors. do(X), backdoor(X) and without(edges) return diagrams
+    that share the arrays and skip the removed edges."""
+    __slots__ = ('names', '_ids', 'hidden', 'graph', 'removed', 
+                 '_pa_ptr', '_pa', '_ch_ptr', '_ch', '_ch_edge', 
+                 'nodes', 'pred', 'succ', '_cache')
+
+    def __init__(self, G):
+        from oyster.utils.graph_utils import hidden_nodes
+        names = list(nx.topological_sort(G))
+        self._compile(names, G.pred, hidden_nodes(G), G.graph)
+
+    def _compile(self, names, pred, hidden, graph, removed=frozenset()):
+        self.names, self._ids = names, None
+        ids = self.ids
+        self.hidden = bytearray(v in hidden for v in names)
+        self.graph = dict(graph)
+        self.removed = removed
+        n = len(names)
+        # Parents in CSR form; an edge's id is its position in _pa
+        self._pa_ptr, self._pa = array('l', [0]), array('l')
+        n_children = [0] * n
+        for v in names:
+            for p in pred[v]:
+                if p in ids:
+                    self._pa.append(ids[p])
+                    n_children[ids[p]] += 1
+            self._pa_ptr.append(len(self._pa))
+        self._ch_ptr = array('l', [0])
+        for count in n_children: self._ch_ptr.append(self._ch_ptr[-1] + count)
+        self._ch = array('l', [0]) * len(self._pa)
+        self._ch_edge = array('l', [0]) * len(self._pa)
+        fill = list(self._ch_ptr[:-1])
+        for j in range(n):
+            for e in range(self._pa_ptr[j], self._pa_ptr[j + 1]):
+                i = self._pa[e]
+                self._ch[fill[i]], self._ch_edge[fill[i]] = j, e
+                fill[i] += 1
+        self._views()
+
+    @classmethod
+    def _from_arrays(cls, names, hidden, graph, pa_ptr, pa, ch_ptr, ch, ch_edge):
+        """A diagram over compiled arrays, such as those of a file mapped
+        into memory by oyster.io.read_binary."""
+        G = object.__new__(cls)
+        G.names, G._ids = names, None
+        G.hidden, G.graph, G.removed = hidden, graph, frozenset()
+        G._pa_ptr, G._pa, G._ch_ptr, G._ch, G._ch_edge = pa_ptr, pa, ch_ptr, ch, ch_edge
+        G._views()
+        return G
+
+    @property
+    def ids(self):
+        """The id of each node, built on first use."""
+        if self._ids is None: self._ids = dict(zip(self.names, range(len(self.names))))
+        return self._ids
+
+    def _views(self):
+        self.nodes = _Nodes(self)
+        self.pred = _Adjacency(self, self._pa_ptr, self._pa)
+        self.succ = _Adjacency(self, self._ch_ptr, self._ch, self._ch_edge)
+        self._cache = OrderedDict()
+
+    def _adjacent(self, i, ptr, idx, edge=None):
+        """Ids of the parents (or children, given their edge ids) of node i,
+        skipping removed edges."""
+        start, end = ptr[i], ptr[i + 1]
+        if not self.removed: return idx[start:end]
+        removed = self.removed
+        return [idx[k] for k in range(start, end) 
+                if (k if edge is None else edge[k]) not in removed]
+
+    # The graph interface
+    @property
+    def edges(self):
+        """The edges of the diagram as (parent, child) pairs."""
+        return _Edges((self.names[self._pa[e]], v) for j, v in enumerate(self.names)
+                      for e in range(self._pa_ptr[j], self._pa_ptr[j + 1]) 
+                      if e not in self.removed)
+
+    def predecessors(self, node): return iter(self.pred[node])
+    def successors(self, node): return iter(self.succ[node])
+    def has_edge(self, u, v): return u in self.ids and v in self.ids and u in self.pred[v]
+    def number_of_nodes(self): return len(self.names)
+    def number_of_edges(self): return len(self._pa) - len(self.removed)
+    def __iter__(self): return iter(self.names)
+    def __contains__(self, node): return node in self.ids
+    def __len__(self): return len(self.names)
+
+    def hidden_nodes(self):
+        """Return the set of hidden nodes."""
+        return {v for v, h in zip(self.names, self.hidden) if h}
+
+    def subgraph(self, nodes):
+        """Return the FrozenCausalDiagram induced by nodes."""
+        nodes = _set(nodes)
+        G = object.__new__(FrozenCausalDiagram)
+        G._compile([v for v in self.names if v in nodes], self.pred, 
+                   self.hidden_nodes() & nodes, self.graph)
+        return G
+
+    def moral_graph(self):
+        """Return the moral graph of the diagram as an nx.Graph."""
+        M = nx.Graph()
+        M.add_nodes_from(self.names)
+        for j, v in enumerate(self.names):
+            parents = [self.names[i] for i in self._adjacent(j, self._pa_ptr, self._pa)]
+            M.add_edges_from((p, v) for p in parents)
+            M.add_edges_from(combinations(parents, 2))
+        return M
+
+    def to_graph(self):
+        """Return the diagram as a CausalDiagram."""
+        G = CausalDiagram()
+        G.graph.update(self.graph)
+        G.add_nodes_from(self.nodes(data=True))
+        G.add_edges_from(self.edges)
+        return G
+
+    # Surgery
+    def _without(self, removed, graph=None):
+        """A diagram sharing these arrays, with edge ids removed."""
+        G = object.__new__(FrozenCausalDiagram)
+        for slot in ('names', '_ids', 'hidden', '_pa_ptr', '_pa', '_ch_ptr', '_ch', '_ch_edge'):
+            setattr(G, slot, getattr(self, slot))
+        G.graph = self.graph if graph is None else graph
+        G.removed = self.removed | removed
+        G._views()
+        return G
+
+    def do(self, X):
+        """Return the diagram with the arrows into X removed."""
+        X = _set(X)
+        graph = None
+        if 'bidirected' in self.graph: # Bidirected edges have an arrow into X too
+            graph = dict(self.graph, bidirected={v: set(nbrs) - X 
+                for v, nbrs in self.graph['bidirected'].items() if v not in X})
+        return self._without({e for x in X for e in range(self._pa_ptr[self.ids[x]], 
+                                                          self._pa_ptr[self.ids[x] + 1])}, graph)
+
+    def backdoor(self, X):
+        """Return the diagram with the arrows out of X removed."""
+        return self._without({self._ch_edge[k] for x in _set(X) 
+                              for k in range(self._ch_ptr[self.ids[x]], 
+                                             self._ch_ptr[self.ids[x] + 1])})
+
+    def without(self, edges):
+        """Return the diagram with edges removed, ignoring those not in it."""
+        removed = set()
+        for u, v in edges:
+            if u not in self.ids or v not in self.ids: continue
+            j = self.ids[v]
+            for e in range(self._pa_ptr[j], self._pa_ptr[j + 1]):
+                if self._pa[e] == self.ids[u]: removed.add(e)
+        return self._without(removed)
+
+    # Native queries
+    def cached(self, key, compute):
+        """Return the result cached under key, computing it if needed."""
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        value = self._cache[key] = compute()
+        if len(self._cache) > 1024: self._cache.popitem(last=False)
+        return value
+
+    def _closure(self, nodes, up):
+        """Ids reached from nodes in one or more steps up or down."""
+        seen, stack = bytearray(len(self.names)), [self.ids[v] for v in _set(nodes)]
+        reached = []
+        while stack:
+            i = stack.pop()
+            neighbors = (self._adjacent(i, self._pa_ptr, self._pa) if up else
+                         self._adjacent(i, self._ch_ptr, self._ch, self._ch_edge))
+            for j in neighbors:
+                if not seen[j]:
+                    seen[j] = 1
+                    reached.append(j)
+                    stack.append(j)
+        return reached
+
+    def ancestors(self, nodes): return {self.names[i] for i in self._closure(nodes, True)}
+    def descendants(self, nodes): return {self.names[i] for i in self._closure(nodes, False)}
+    def parents(self, nodes): return {p for v in _set(nodes) for p in self.pred[v]}
+    def children(self, nodes): return {c for v in _set(nodes) for c in self.succ[v]}
+    def markov_blanket(self, nodes):
+        return {m for v in _set(nodes) for m in 
+                self.parents(v) | self.children(v) | self.parents(self.succ[v]) if m != v}
+
+    def reachable(self, X, Z):
+        """Return the nodes reachable from X along active trails given Z
+        (the Bayes-Ball traversal of adjust._reachable, on node ids)."""
+        n = len(self.names)
+        bidirected = self.graph.get('bidirected', {})
+        def spouses(i): 
+            return [(self.ids[v], 1) for v in bidirected.get(self.names[i], ()) if v in self]
+        in_Z = bytearray(n)
+        for v in _set(Z): in_Z[self.ids[v]] = 1
+        in_A = bytearray(in_Z) # Z and its ancestors
+        for i in self._closure(_set(Z), True): in_A[i] = 1
+        visited = (bytearray(n), bytearray(n)) # Arrived from a child, a parent
+        reached = set()
+        stack = [(self.ids[v], 0) for v in _set(X)]
+        while stack:
+            i, down = stack.pop()
+            if visited[down][i]: continue
+            visited[down][i] = 1
+            if not in_Z[i]: reached.add(self.names[i])
+            if not down and not in_Z[i]:
+                stack.extend((p, 0) for p in self._adjacent(i, self._pa_ptr, self._pa))
+                stack.extend(spouses(i))
+                stack.extend((c, 1) for c in self._adjacent(i, self._ch_ptr, self._ch, self._ch_edge))
+            elif down:
+                if not in_Z[i]:
+                    stack.extend((c, 1) for c in self._adjacent(i, self._ch_ptr, self._ch, self._ch_edge))
+                if in_A[i]:
+                    stack.extend((p, 0) for p in self._adjacent(i, self._pa_ptr, self._pa))
+                    stack.extend(spouses(i))
+        return reached
@@ -1,104 +1,274 @@
 """Functions for generating equivalent DAGs and and working with Complete Partial DAGs."""
 
+import heapq
+import random
+from collections import OrderedDict
+import networkx as nx
+from itertools import combinations
+from math import factorial
 from oyster.utils.graph_utils import *
 from oyster.utils.set_utils import *
 
 def dag_to_cpdag(DAG):
-    """Given a causal DAG, generate the completed partial DAG (CPDAG)
-    that encapsulates DAG's equivalence class using R1-4 from Pearl 2009."""
+    """Given a causal DAG, return the completed partial DAG (CPDAG) that 
+    encapsulates DAG's equivalence class, with compelled edges oriented 
+    and an edge in both directions for every reversible edge, and 
+    graph['cpdag'] set.
     
-    def oriented_v_structures(DAG):
-        """Return a partial DAG (pDAG) with edges oriented to match DAG's 
-        v_structures and an edge in both directions for all other edges."""
-        collider_out_edges = []
-        for collider, set_of_parent_pairs in v_structures(DAG).items():
-            for parent_pair in set_of_parent_pairs:
-                pair = list(parent_pair)
-                collider_out_edges.append((collider, pair[0]))
-                collider_out_edges.append((collider, pair[1]))
-        return edges_removed(bidirected(DAG), collider_out_edges)
-    
-    def rule1(pDAG):
-        """Return a pDAG with any b<->c oriented to b->c whenever 
-        there is an arrow a->b such that a and c are non-adjacent."""
-        nonadjacent = is_in(NA_pairs(pDAG))
-        compelled = is_in(compelled_edges(pDAG))
-        inconsistent_edges = set()
-        for (b,c) in reversible_edges(pDAG):
-            for a in pDAG.nodes() - {b} - {c}:
-                if compelled((a,b)) and nonadjacent({a,c}):
-                    inconsistent_edges.add((c, b))       
-        return edges_removed(pDAG, inconsistent_edges)
-
-    def rule2(pDAG):
-        """Return a pDAG with any a<->b oriented to a->b whenever 
-        there is a chain a->c->b."""
-        compelled = is_in(compelled_edges(pDAG))
-        inconsistent_edges = set()
-        for (a,b) in reversible_edges(pDAG):
-            for c in pDAG.nodes() - {a} - {b}:
-                if compelled((a,c)) and compelled((c,b)):
-                    inconsistent_edges.add((b,a))        
-        return edges_removed(pDAG, inconsistent_edges)
-        
-    def rule3(pDAG):
-        """Return a pDAG with any a<->b oriented to a->b whenever 
-        there are two rule3-type chains (see below)."""
-        rvs_edges = reversible_edges(pDAG)
-        nonadjacent = is_in(NA_pairs(pDAG))
-        compelled = is_in(compelled_edges(pDAG))
-        reversible = is_in(rvs_edges)
-    
-        def two_rule3_chains(a,b):
-            """Return if there are two chains between a and b of form 
-            a<->c->b and a<->d->b and such that c and d are nonadjacent."""
-            for c in pDAG.nodes() - {a} - {b}:
-                if reversible((a,c)) and compelled((c,b)):
-                    for d in pDAG.nodes() - {a} - {b} - {c}:
-                        if all((reversible((a,d)), compelled((d,b)),
-                                nonadjacent({c,d}))): return True
-            return False
-
-        inconsistent_edges = set()
-        for (a,b) in rvs_edges:
-            if two_rule3_chains(a,b): inconsistent_edges.add((b,a))
-        return edges_removed(pDAG, inconsistent_edges)
-
-    def rule4(pDAG):
-        """Return a pDAG with any a<->b oriented to a->b whenever 
-        there are two rule4-type chains (see below)."""
-        rvs_edges = reversible_edges(pDAG)
-        nonadjacent = is_in(NA_pairs(pDAG))
-        def adjacent(pair): return not nonadjacent(pair)
-        compelled = is_in(compelled_edges(pDAG))
-        reversible = is_in(rvs_edges)
-
-        def two_rule4_chains(a,b):
-            """Return if there are two chains between a and b of form 
-            a--c->d and c->d->b and such that c and b are nonadjacent 
-            and a and d are adjacent."""
-            for c in pDAG.nodes() - {a} - {b}:
-                for d in pDAG.nodes() - {a} - {b} - {c}:
-                    if all((reversible((a,c)), compelled((c,d)), 
-                            compelled((d,b)), nonadjacent({c,b}), 
-                            adjacent({a,d}))): return True
-            return False
-
-        inconsistent_edges = set()
-        for (a,b) in rvs_edges:
-            if two_rule4_chains(a,b): inconsistent_edges.add((b,a))
-        return edges_removed(pDAG, inconsistent_edges)
-
-    pDAG = oriented_v_structures(DAG)
-    # Apply rules 1-4 until no more edges can be oriented
-    new_pDAG = rule4(rule3(rule2(rule1(pDAG))))
-    while not equal(new_pDAG, pDAG):
-        pDAG = new_pDAG
-        new_pDAG = rule4(rule3(rule2(rule1(pDAG)))) 
-    cpDAG = new_pDAG
+    Labels edges with Chickering's (1995) algorithm in O(|V| + |E|·Δ):
+    the edges into each node, visited in topological order, are labeled 
+    together from the compelled edges into its highest-ordered parent."""
+    order = list(nx.topological_sort(DAG))
+    position = {node: i for i, node in enumerate(order)}
+    compelled = {} # node -> parents with a compelled edge into node
+    cpDAG = nx.DiGraph()
+    cpDAG.graph.update(DAG.graph, cpdag=True)
+    cpDAG.add_nodes_from(DAG.nodes(data=True))
+    for y in order:
+        parents = set(DAG.pred[y])
+        compelled[y] = set()
+        if not parents: continue
+        x = max(parents, key=position.get)
+        if compelled[x] - parents: # w -> x -> y with w, y nonadjacent
+            compelled[y] = parents
+        else:
+            compelled[y] = compelled[x] | ( # w -> y for every w -> x
+                parents if any(z not in DAG.pred[x] for z in parents - {x}) 
+                else set())
+        for p in parents:
+            cpDAG.add_edge(p, y, **DAG.edges[p, y])
+            if p not in compelled[y]: cpDAG.add_edge(y, p, **DAG.edges[p, y])
     return cpDAG
 
+### Counting Equivalent DAGs ###
+def chain_components(cpDAG):
+    """Return the undirected graphs formed by the reversible edges of 
+    cpDAG, one per connected component with at least one edge."""
+    undirected = nx.Graph(edge for edge in cpDAG.edges 
+                          if cpDAG.has_edge(*reversed(edge)))
+    return [undirected.subgraph(c).copy() 
+            for c in nx.connected_components(undirected)]
+
+def cpdag_size(cpDAG):
+    """Return the number of DAGs in the equivalence class of cpDAG."""
+    size = 1
+    for component in chain_components(cpDAG): size *= amo_count(component)
+    return size
+
 def equivalence_class_size(DAG):
     """Return the size of the DAG's equivalence class."""
-    cpdag = dag_to_cpdag(DAG)
-    return 2 ** (len(reversible_edges(cpdag)) // 2)
+    return cpdag_size(dag_to_cpdag(DAG))
+
+def _pick(G, clique):
+    """Orient the chordal graph G with the clique (a list, in order) as its 
+    sources. Return the edges this orients and the chain components left.
+    
+    Meek's rule 1 alone completes such orientations: a -> b -- c with a, c 
+    nonadjacent orients b -> c."""
+    adjacent = {v: set(G[v]) for v in G}
+    undirected = {v: set(G[v]) for v in G}
+    arcs = []
+    def orient(u, v):
+        undirected[u].discard(v); undirected[v].discard(u)
+        arcs.append((u, v))
+    for i, u in enumerate(clique):
+        for v in undirected[u] - set(clique[:i]): orient(u, v)
+    for a, b in arcs: # Grows as edges are oriented
+        for c in undirected[b] - adjacent[a]: orient(b, c)
+    remaining = nx.Graph({v: undirected[v] for v in G if undirected[v]})
+    return arcs, [remaining.subgraph(c).copy() 
+                  for c in nx.connected_components(remaining)]
+
+def _prefix_free_orders(S, prefixes):
+    """Return the number of orderings of S in which no initial segment is 
+    one of prefixes, a list of subsets of S increasing by inclusion."""
+    count = factorial(len(S))
+    for i, R in enumerate(prefixes):
+        count -= _prefix_free_orders(R, prefixes[:i]) * factorial(len(S - R))
+    return count
+
+def _clique_tree(G):
+    """Return the maximal cliques of the chordal graph G, each with the index 
+    of its parent clique and their separator in a clique tree rooted at the 
+    first clique, from a maximum cardinality search (Blair and Peyton 1993)."""
+    weight = {v: 0 for v in G}
+    position, clique_of = {}, {}
+    cliques, parents, separators = [], [], []
+    previous = -1
+    while weight:
+        v = max(weight, key=weight.get)
+        earlier = frozenset(G[v]) & clique_of.keys()
+        if len(earlier) <= previous or not cliques: # v starts a new clique
+            last = max(earlier, key=position.get, default=None)
+            cliques.append({v} | earlier)
+            parents.append(clique_of[last] if earlier else None)
+            separators.append(earlier)
+        else:
+            cliques[-1].add(v)
+        clique_of[v] = len(cliques) - 1
+        position[v] = len(position)
+        previous = len(earlier)
+        del weight[v]
+        for w in G[v]:
+            if w in weight: weight[w] += 1
+    return [frozenset(K) for K in cliques], parents, separators
+
+def _picks(G):
+    """Generate (K, prefixes, count) for each clique K of a rooted clique 
+    tree of the connected chordal graph G, where count is the number of 
+    AMOs whose sources are K but not a clique nearer the root, and those 
+    orient K in an order that does not start with one of prefixes
+    (Wienöbst et al. 2021)."""
+    cliques, parents, separators = _clique_tree(G)
+    for i, K in enumerate(cliques):
+        # Separators on the path from K to the root that lie within K,
+        # which shrink towards the root by the running intersection property
+        prefixes, j = [], i
+        while parents[j] is not None:
+            if separators[j] <= K and separators[j] not in prefixes:
+                prefixes.insert(0, separators[j])
+            j = parents[j]
+        count = _prefix_free_orders(K, prefixes)
+        for H in _pick(G, sorted(K, key=str))[1]: count *= amo_count(H)
+        yield K, prefixes, count
+
+_COUNTS_SIZE = 4096
+_counts = OrderedDict() # Edges of a component -> count, least recently used first
+
+def amo_count(G):
+    """Return the number of acyclic moral orientations (those without 
+    v-structures) of the connected undirected chordal graph G, i.e. the 
+    size of the equivalence class of a chain component. The counts of the
+    most recently counted components are cached by their edges."""
+    n, m = len(G), G.number_of_edges()
+    if m == n - 1: return n # Trees: one orientation per root
+    if 2 * m == n * (n - 1): return factorial(n) # Cliques
+    key = frozenset(map(frozenset, G.edges))
+    if key in _counts:
+        _counts.move_to_end(key)
+        return _counts[key]
+    count = sum(count for _, _, count in _picks(G)) # Clique-Picking
+    _counts[key] = count
+    if len(_counts) > _COUNTS_SIZE: _counts.popitem(last=False)
+    return count
+
+
+### Enumerating Equivalent DAGs ###
+def _meek_closure(undirected, parents):
+    """Orient the edges of a partially directed graph by Meek's rules 1-4 
+    until none applies. undirected and parents map each node to its 
+    undirected neighbors and its parents and are updated in place."""
+    children = {v: set() for v in undirected}
+    for v in parents:
+        for p in parents[v]: children[p].add(v)
+    adjacent = {v: undirected[v] | parents[v] | children[v] for v in undirected}
+    def compelled(a, b):
+        return (bool(parents[a] - adjacent[b]) or # R1
+                bool(children[a] & parents[b]) or # R2
+                any(d not in adjacent[c] for c, d in combinations( # R3
+                    undirected[a] & parents[b], 2)) or
+                any(parents[d] & adjacent[a] - adjacent[b] # R4
+                    for d in parents[b] & adjacent[a]))
+    def near(nodes): # Undirected edges whose rules may have changed
+        return {edge for u in nodes for v in undirected[u] 
+                for edge in ((u, v), (v, u))}
+    unchecked = near(undirected)
+    while unchecked:
+        a, b = unchecked.pop()
+        if b in undirected[a] and compelled(a, b):
+            undirected[a].discard(b); undirected[b].discard(a)
+            parents[b].add(a); children[a].add(b)
+            unchecked |= near({a, b} | children[b])
+
+def _orientation(cpDAG, parents):
+    """Return a view of cpDAG with each node's edges in from parents only,
+    marked as a DAG."""
+    return _without(cpDAG, {(v, p) for v in parents for p in parents[v]})
+
+def _without(cpDAG, reversed_edges):
+    """Return a view of cpDAG without reversed_edges, marked as a DAG."""
+    DAG = edges_removed(cpDAG, reversed_edges)
+    DAG.graph = dict(cpDAG.graph, cpdag=False)
+    return DAG
+
+def consistent_extension(cpDAG):
+    """Return a DAG in the equivalence class of cpDAG, as a view like 
+    those of equivalent_dags, in O(|V| + |E| log |V|).
+    
+    Reversible edges are oriented along a maximum cardinality search,
+    which orients each chordal chain component without cycles or 
+    v-structures (Andersson et al. 1997). For a CPDAG marked with 
+    graph['cpdag'] the orientation is kept in graph['extension'] until 
+    its number of edges changes, so later calls take O(|V|)."""
+    size = cpDAG.number_of_edges()
+    cached = cpDAG.graph.get('extension')
+    if cached is not None and cached[0] == size: return _without(cpDAG, cached[1])
+    undirected = {v: {u for u in cpDAG.succ[v] if u in cpDAG.pred[v]} 
+                  for v in cpDAG}
+    parents = {v: set(cpDAG.pred[v]) - undirected[v] for v in cpDAG}
+    weight, visited = {v: 0 for v in cpDAG}, set()
+    ids = {v: i for i, v in enumerate(cpDAG)} # Breaks ties between nodes
+    heap = [(0, ids[v], v) for v in cpDAG]
+    while heap:
+        _, _, v = heapq.heappop(heap)
+        if v in visited: continue
+        visited.add(v)
+        for u in undirected[v] - visited:
+            parents[u].add(v)
+            weight[u] += 1
+            heapq.heappush(heap, (-weight[u], ids[u], u))
+    reversed_edges = frozenset((v, p) for v in parents for p in parents[v])
+    if cpDAG.graph.get('cpdag'): cpDAG.graph['extension'] = (size, reversed_edges)
+    return _without(cpDAG, reversed_edges)
+
+def equivalent_dags(cpDAG):
+    """Generate each DAG in the equivalence class of cpDAG once, as a view 
+    of cpDAG with one direction of every reversible edge removed.
+    
+    Branches on the orientation of an undirected edge and completes each 
+    branch by Meek's rules, which never leads to a dead end, so DAGs 
+    are generated with polynomial delay."""
+    undirected = {v: {u for u in cpDAG.succ[v] if cpDAG.has_edge(u, v)} 
+                  for v in cpDAG}
+    parents = {v: set(cpDAG.pred[v]) - undirected[v] for v in cpDAG}
+    stack = [(undirected, parents)]
+    while stack:
+        undirected, parents = stack.pop()
+        edge = next(((u, v) for u in undirected for v in undirected[u]), None)
+        if edge is None:
+            yield _orientation(cpDAG, parents)
+            continue
+        for a, b in (edge[::-1], edge):
+            U = {v: set(ns) for v, ns in undirected.items()}
+            P = {v: set(ps) for v, ps in parents.items()}
+            U[a].discard(b); U[b].discard(a); P[b].add(a)
+            _meek_closure(U, P)
+            stack.append((U, P))
+
+def _sample_amo(G, rng):
+    """Return the edges of an AMO of the connected chordal graph G,
+    chosen uniformly at random."""
+    picks = list(_picks(G))
+    r = rng.randrange(sum(count for _, _, count in picks))
+    for K, prefixes, count in picks:
+        if r < count: break
+        r -= count
+    order = list(K)
+    rng.shuffle(order)
+    while any(set(order[:len(R)]) == R for R in prefixes):
+        rng.shuffle(order)
+    arcs, components = _pick(G, order)
+    for H in components: arcs.extend(_sample_amo(H, rng))
+    return arcs
+
+def sample_dag(cpDAG, rng=random):
+    """Return a DAG chosen uniformly at random from the equivalence class 
+    of cpDAG, as a view of cpDAG like those of equivalent_dags.
+    
+    Each chain component picks a clique tree clique as its sources with 
+    probability proportional to its Clique-Picking count, then an order 
+    of the clique and the remaining components in turn."""
+    parents = {v: set(cpDAG.pred[v]) for v in cpDAG}
+    for component in chain_components(cpDAG):
+        for u, v in _sample_amo(component, rng): parents[u].discard(v)
+    return _orientation(cpDAG, parents)
@@ -1,46 +1,232 @@
 """Algorithms for determining identifiability of causal diagrams."""
 
-from oyster.utils.graph_utils import (An, Ch, De, observable_nodes, 
-                                      observable_pairs, ancestral_graph, 
-                                      do_X)
+import networkx as nx
+from collections import namedtuple
+from oyster.utils.graph_utils import (Ch, ancestral_graph, is_admg,
+                                      latent_projection)
 from oyster.utils.set_utils import _set
-from oyster.structures import paths, c_components, has_confounded_path
+from oyster.utils.profiling import instrumented, count, maximum
+from oyster.structures import confounded_nodes
+from oyster.diagram import FrozenCausalDiagram
+from oyster.surgery import Surgery
 
 
 def is_identifiable_single_x(G, X, Y):
     """Return if the causal effect of singletons X and Y in G
     is identifiable based on the criterion in Tian and Pearl 2002."""
-    return not any(
-        [has_confounded_path(ancestral_graph(G, Y), X, ChX) 
-         for ChX in Ch(G, X)])
+    A = ancestral_graph(G, Y)
+    return X not in A or not confounded_nodes(A, X) & Ch(A, X)
 
-def is_identifiable(G, X, Y, print_hedge=False):
+@instrumented
+def is_identifiable(G, X, Y, print_hedge=False, estimand=False):
     """Return if the causal effect of variables X on variables Y in G
-    is identifiable based on algorithm ID in Shpitser and Pearl 2008."""
-    C = c_components
-    X = _set(X)
-    Y = _set(Y)
-    V = observable_nodes(G)
-    Gprime = G.subgraph(G.nodes - X)
-    
-    if X == set(): return True # Line 1
-    
-    if V - An(G, Y) - Y != set(): # Line 2
-        return is_identifiable(ancestral_graph(G, Y), X & An(G, Y), Y)
-    
-    W = (V - X) - An(do_X(G, X), Y) - Y 
-    if W != set(): return is_identifiable(G, X|W, Y) # Line 3
-
-    Sk = C(Gprime)
-    if len(Sk) > 1: # Line 4
-        return all(is_identifiable(G, V - S, S) for S in Sk)
-    else: 
+    is identifiable based on algorithm ID in Shpitser and Pearl 2008.
+
+    With estimand=True, return the identifying expression for P(Y | do(X))
+    instead of True, or the Hedge that witnesses non-identifiability
+    instead of False. Use an Identifier to share work across queries."""
+    return Identifier(G).identify(X, Y, print_hedge, estimand)
+
+
+### Estimands ###
+def _vals(nodes):
+    """Represent variables as a comma-separated list of values."""
+    return ','.join(sorted(str(v) for v in nodes)).lower()
+
+class Probability:
+    """The (maybe conditional) observational probability P(V | given)."""
+    def __init__(self, V, given=()):
+        self.V, self.given = frozenset(V), frozenset(given)
+    def __str__(self):
+        given = f' | {_vals(self.given)}' if self.given else ''
+        return f'P({_vals(self.V)}{given})'
+    def latex(self): return str(self)
+
+class Sum:
+    """The sum of an expression over the values of variables."""
+    def __init__(self, over, term):
+        self.over, self.term = frozenset(over), term
+    def __str__(self): return f'Σ_{{{_vals(self.over)}}} {self.term}'
+    def latex(self): return f'\\sum_{{{_vals(self.over)}}} {self.term.latex()}'
+
+class Product:
+    """The product of expressions."""
+    def __init__(self, terms):
+        self.terms = list(terms)
+    def __str__(self): return ' '.join(_bracket(t, str) for t in self.terms)
+    def latex(self): return ' '.join(_bracket(t, lambda e: e.latex()) for t in self.terms)
+
+class Quotient:
+    """The ratio of two expressions."""
+    def __init__(self, numerator, denominator):
+        self.numerator, self.denominator = numerator, denominator
+    def __str__(self): return f'{_bracket(self.numerator, str)} / {_bracket(self.denominator, str)}'
+    def latex(self): return f'\\frac{{{self.numerator.latex()}}}{{{self.denominator.latex()}}}'
+
+def _bracket(expression, render):
+    """Render an expression, bracketing compound terms."""
+    text = render(expression)
+    return f'[{text}]' if isinstance(expression, (Sum, Quotient)) else text
+
+def _summed(over, term):
+    """Return the sum of term over variables, dropping empty sums."""
+    return Sum(over, term) if over else term
+
+def _product(terms):
+    """Return the product of terms, dropping singleton products."""
+    terms = list(terms)
+    return terms[0] if len(terms) == 1 else Product(terms)
+
+Hedge = namedtuple('Hedge', ['F', 'F_prime'])
+Hedge.__doc__ = """A hedge for P(Y | do(X)) (Shpitser and Pearl 2008): a pair
+of c-forests F' ⊂ F witnessing that the effect is not identifiable.
+Hedges are falsy, so they can stand in for a negative result."""
+Hedge.__bool__ = lambda self: False
+
+
+### Algorithm ID ###
+class _Distribution:
+    """An interventional distribution P_{v\\S}(S) over the node set S as
+    carried through algorithm ID, with the factors P(v | predecessors)
+    in the engine's topological order when they are known."""
+    def __init__(self, nodes, factors=None, expression=None):
+        self.nodes, self.factors, self.expression = nodes, factors, expression
+
+class Identifier:
+    """Algorithm ID (Shpitser and Pearl 2008) for one causal diagram.
+
+    Works on the latent projection of the diagram, where every subproblem
+    is an induced subgraph. Results are cached on (node set, X, Y) and
+    c-component decompositions on the node set, so repeated subproblems
+    are solved once across the recursion and across queries."""
+    def __init__(self, G):
+        if isinstance(G, (Surgery, FrozenCausalDiagram)): G = G.to_graph()
+        self.G = G if is_admg(G) else latent_projection(G)
+        self.order = list(nx.topological_sort(self.G))
+        self.position = {v: i for i, v in enumerate(self.order)}
+        self.parents = {v: set(self.G.pred[v]) for v in self.G}
+        self.bidirected = {v: set(self.G.graph['bidirected'].get(v, ()))
+                           for v in self.G}
+        self.V = frozenset(self.G.nodes)
+        self._components = {}
+        self._results = {}
+        self._depth = 0
+
+    @instrumented
+    def identify(self, X, Y, print_hedge=False, estimand=False):
+        """Return if P(Y | do(X)) is identifiable, or its estimand/Hedge."""
+        X, Y = frozenset(_set(X)), frozenset(_set(Y))
+        result = self.ID(Y, X, _Distribution(self.V), self.V)
+        if print_hedge and isinstance(result, Hedge):
+            print(f'Hedge at ({set(result.F)}, {set(result.F_prime)})')
+        return result if estimand else not isinstance(result, Hedge)
+
+    def c_components(self, S):
+        """The c-components of the subgraph induced by S."""
+        if S not in self._components:
+            components, assigned = [], set()
+            for v in self.ordered(S):
+                if v in assigned: continue
+                component, stack = {v}, [v]
+                while stack:
+                    for w in self.bidirected[stack.pop()] & S - component:
+                        component.add(w)
+                        stack.append(w)
+                assigned |= component
+                components.append(frozenset(component))
+            self._components[S] = components
+        return self._components[S]
+
+    def ancestors(self, Y, S, X=frozenset()):
+        """Y and its ancestors in the subgraph induced by S,
+        with the arrows into X removed."""
+        found, stack = set(Y), list(Y)
+        while stack:
+            v = stack.pop()
+            if v in X: continue
+            for p in self.parents[v] & S - found:
+                found.add(p)
+                stack.append(p)
+        return frozenset(found)
+
+    def predecessors(self, v, S):
+        """Nodes of S before v in the topological order."""
+        return {w for w in S if self.position[w] < self.position[v]}
+
+    def ordered(self, S):
+        """Nodes of S in the topological order."""
+        return sorted(S, key=self.position.get)
+
+    # Operations on the distributions carried through the recursion
+    def conditional(self, P, v):
+        """P(v | predecessors of v in P's nodes)."""
+        preds = self.predecessors(v, P.nodes)
+        if P.expression is None: return Probability({v}, preds)
+        if P.factors is not None: return P.factors[v]
+        return Quotient(_summed(P.nodes - preds - {v}, P.expression),
+                        _summed(P.nodes - preds, P.expression))
+
+    def joint(self, P):
+        """An expression for P over all its nodes."""
+        if P.expression is None: return Probability(P.nodes)
+        return P.expression
+
+    def marginal(self, P, A):
+        """Σ_{P.nodes \\ A} P, as a distribution over A."""
+        if P.expression is None: return _Distribution(A)
+        if P.factors is not None:
+            last = max((self.position[v] for v in A), default=-1)
+            if all(self.position[v] > last for v in P.nodes - A): # A is a prefix
+                factors = {v: P.factors[v] for v in A}
+                return _Distribution(A, factors,
+                                     _product(factors[v] for v in self.ordered(A)))
+        return _Distribution(A, None, _summed(P.nodes - A, P.expression))
+
+    def ID(self, Y, X, P, V):
+        """Return an expression for P_X(Y) from P over the subgraph
+        induced by V, or the Hedge that makes it non-identifiable."""
+        key = (V, X, Y)
+        if key not in self._results:
+            self._depth += 1
+            maximum('ID recursion depth', self._depth)
+            try: self._results[key] = self._ID(Y, X, P, V)
+            finally: self._depth -= 1
+        return self._results[key]
+
+    def _ID(self, Y, X, P, V):
+        if not X: # Line 1
+            count('ID line 1')
+            return self.joint(self.marginal(P, Y))
+
+        ancestors = self.ancestors(Y, V)
+        if ancestors != V: # Line 2
+            count('ID line 2')
+            return self.ID(Y, X & ancestors, self.marginal(P, ancestors), ancestors)
+
+        W = (V - X) - self.ancestors(Y, V, X)
+        if W: # Line 3
+            count('ID line 3')
+            return self.ID(Y, X | W, P, V)
+
+        Sk = self.c_components(V - X)
+        if len(Sk) > 1: # Line 4
+            count('ID line 4')
+            terms = [self.ID(S, V - S, P, V) for S in Sk]
+            hedge = next((t for t in terms if isinstance(t, Hedge)), None)
+            if hedge is not None: return hedge
+            return _summed(V - (Y | X), _product(terms))
         S = Sk[0]
-        if any(c == V for c in C(G)): # Line 5
-            if print_hedge: print(f'Hedge at ({V}, {V&S})')
-            return False 
-        if S in C(G): # Line 6
-            return True
-        else: # Line 7
-            Sprime = [c for c in C(G) if S < c][0]
-            return is_identifiable(G.subgraph(Sprime | Y), X & Sprime, Y) 
\ No newline at end of file
+        components = self.c_components(V)
+        if components == [V]: # Line 5
+            count('ID line 5')
+            return Hedge(V, S)
+        if S in components: # Line 6
+            count('ID line 6')
+            return _summed(S - Y, _product(self.conditional(P, v) for v in self.ordered(S)))
+        # Line 7
+        count('ID line 7')
+        Sprime = next(c for c in components if S < c)
+        factors = {v: self.conditional(P, v) for v in Sprime}
+        Pprime = _Distribution(Sprime, factors,
+                               _product(factors[v] for v in self.ordered(Sprime)))
+        return self.ID(Y, X & Sprime, Pprime, Sprime)
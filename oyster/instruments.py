@@ -1,10 +1,10 @@
-from oyster.adjust import d_separated, d_separator_search
-from oyster.utils.graph_utils import (do_X, De, An, 
-                                      observable_nodes, hidden_nodes, 
-                                      backdoor_graph, edges_removed,
+from oyster.adjust import d_separated, find_separator, separators
+from oyster.utils.graph_utils import (De, An, observable_nodes, backdoor_graph,
                                       moral_graph, ancestral_graph)
-from oyster.structures import paths
-from oyster.utils.set_utils import _set, minimal_sets
+from oyster.utils.set_utils import _set, Antichain
+from oyster.utils.search import Budget, search
+from oyster.utils.profiling import instrumented
+from oyster.surgery import surgery
 
 
 ### Exhaustive Instrumental Variable Search ###
@@ -14,32 +14,77 @@ def is_instrumental_variable(DAG, X, Y, Z, W=set()):
     for the effect of X on Y in DAG, potentially
     conditional on W.
     
-    From the graphical definition in Pearl 2009."""
+    From the graphical definition in Pearl 2009: Z and Y are d-separated
+    by W in the graph without arrows out of X, and Z and X are not."""
     return all((
-        d_separated(do_X(DAG, X), Z, Y, W),
+        d_separated(surgery(DAG).backdoor(X), Z, Y, W),
         not d_separated(DAG, Z, X, W),
         not _set(W) & De(DAG, Y) # no descendants of Y in W
     ))
 
-def instrumental_variable_search(DAG, X, Y):
-    # for all variables in DAG - X - Y...
-        # unconditional instrument?
-        # if so, stop?
-        # if not, intersection of d_separator_search(do_X(DAG, X), Z, Y)
-        # and d_separator_search(DAG, Z, X)
-        # return any not decendants of Y
-    DeY = De(DAG, Y)
-    potential_Zs = observable_nodes(DAG) - _set(X) - _set(Y)
+def _instrumenting_sets(DAG, Gx, X, Y, Z, R, budget):
+    """Generate the minimal sets W ⊆ R that d-separate Z and Y in Gx but
+    not Z and X in DAG.
     
-    ivs = []
-    for Z in potential_Zs:
-        poss_Ws = [W for W in d_separator_search(backdoor_graph(DAG, X), Z, Y) 
-                   if not (hidden_nodes(DAG) | _set(X)) & W] 
-        Ws = [W for W in poss_Ws
-              if not d_separated(DAG, Z, X, W) and not W & DeY]
-        if Ws: ivs.append((Z, minimal_sets(Ws)))
-             
-    return ivs
+    ListSep over the separators of Z and Y in Gx, excluding each node 
+    first so that every set is listed after its subsets. A branch whose 
+    included nodes contain a listed set holds no minimal set and is cut."""
+    found = Antichain()
+    stack = [(set(), set(R))]
+    while stack:
+        I, R = stack.pop()
+        if not budget.fits(I) or found.dominated(I): continue
+        if not budget.spend(): return
+        if find_separator(Gx, Z, Y, I, R) is None: continue
+        if I == R:
+            if not d_separated(DAG, Z, X, I):
+                found.add(I)
+                yield set(I)
+            continue
+        v = next(iter(R - I))
+        stack.append((I | {v}, R))
+        stack.append((I, R - {v}))
+
+def _separating_sets(DAG, Gx, X, Y, Z, R, budget):
+    """Generate the minimal separators W ⊆ R of Z and Y in Gx that do not 
+    d-separate Z and X in DAG, or if there are none the set found by 
+    ancestral_instrument, if Z is an instrument conditional on it."""
+    found = False
+    for W in separators(Gx, Z, Y, R=R, minimal=True, budget=budget):
+        if not d_separated(DAG, Z, X, W):
+            found = True
+            yield W
+    if found or budget.truncated: return
+    W = ancestral_instrument(DAG, X, Y, Z)
+    if W != '⊥' and budget.fits(W) and is_instrumental_variable(DAG, X, Y, Z, W): yield W
+
+@instrumented
+def instrumental_variables(DAG, X, Y, budget=None, exact=False):
+    """Generate (Z, Ws) for the instrumental variables Z for the effect 
+    of X on Y in DAG, where Ws are sets of observable nodes W such that 
+    Z is an instrument conditional on W, within budget.
+    
+    Candidate sets W are the minimal separators of Z and Y in the graph 
+    without arrows out of X, listed with polynomial delay, and failing 
+    those the set found by ancestral_instrument. Sets that make Z 
+    dependent on X only by adding colliders to a separator are missed.
+    With exact=True, Ws are all the minimal sets, found by a search over
+    the separators of Z and Y that can take exponential time."""
+    Gx = backdoor_graph(DAG, X)
+    observed = observable_nodes(DAG) - _set(X) - _set(Y)
+    allowed = observed - De(DAG, Y)
+    budget = Budget() if budget is None else budget
+    sets = _instrumenting_sets if exact else _separating_sets
+    
+    for Z in observed:
+        Ws = Antichain(sets(DAG, Gx, X, Y, Z, allowed - {Z}, budget))
+        if Ws: yield Z, list(Ws)
+        if budget.truncated: return
+
+def instrumental_variable_search(DAG, X, Y, budget=None, lazy=False, exact=False):
+    """Return a list of (Z, Ws) for the instrumental variables Z for the 
+    effect of X on Y in DAG (see instrumental_variables)."""
+    return search(instrumental_variables(DAG, X, Y, budget, exact), budget, lazy)
 
 ### Ancestral Instrument Search ###
 # Faster, guaranteed to find an instrument if one exists, 
@@ -55,50 +100,61 @@ def is_ancestral_instrument(DAG, X, Y, Z, W=set()):
     Note van der Zander's assumption that DAG 
     includes an edge X->Y, so not sure this covers all
     cases."""
-    Gc = edges_removed(DAG, [(X, Y)])
+    Gc = surgery(DAG).without([(X, Y)])
     return all((
         not d_separated(DAG, Z, X, W),
         d_separated(Gc, Z, Y, W),
         not _set(W) & De(DAG, Y),
-        (bool(_set(W) & (oy.An(DAG, Y) | oy.An(DAG, Z))) 
-         if _set(W) else True)
+        _set(W) <= An(DAG, Y) | An(DAG, Z)
     ))
     
 def nearest_separator(DAG, Y, Z):
+    """Return the set W of observable nodes nearest to Y that d-separates 
+    Y and Z in DAG, or '⊥' if there is no such set.
+    
+    From van der Zander et al. 2015, in O(|V| + |E|) as two searches of the 
+    moral graph of An(Y ∪ Z): the observable nodes first reached from Y 
+    through unobservable ones are the candidates, and W holds those that 
+    Z reaches without passing through Y or another candidate."""
     M = observable_nodes(DAG)
     moral = moral_graph(ancestral_graph(DAG, [Y, Z]))
     
-    W = set()
-    for path in paths(moral, Y, Z):
-        pi = path.nodes
-        Vs = list(pi)[1:-1]
-
-        if all((
-            len(pi) > 2, # Vs other than Y,Z
-            not W & pi, # pi not blocked by W
-            set(Vs) & M # at least one observable V
-        )):
-            W |= _set(next(V for V in Vs if V in M))
-            
+    candidates, seen, stack = set(), {Y, Z}, [Y]
+    while stack:
+        for V in moral[stack.pop()]:
+            if V in seen: continue
+            seen.add(V)
+            if V in M: candidates.add(V)
+            else: stack.append(V)
+    
+    W, seen, stack = set(), {Y, Z}, [Z]
+    while stack:
+        for V in moral[stack.pop()]:
+            if V in candidates: W.add(V)
+            elif V not in seen:
+                seen.add(V)
+                stack.append(V)
+    
     if d_separated(DAG, Z, Y, W):
         return(W)
     else:
         return('⊥') # Separator not found
 
 def ancestral_instrument(DAG, X, Y, Z):
-    Gc = edges_removed(DAG, [(X, Y)])
+    Gc = surgery(DAG).without([(X, Y)])
     W = nearest_separator(Gc, Y, Z)
     
     if W == '⊥': return '⊥'
     if W & De(DAG, Y) != set(): return '⊥'
-    if _set(X) < W: return '⊥'  
+    if _set(X) & W: return '⊥'
     return W if not d_separated(Gc, Z, X, W) else '⊥'
     
 def ancestral_instrument_search(DAG, X, Y):
-    possible_instruments = DAG.nodes - _set(X) - _set(Y) - De(DAG, Y)
+    possible_instruments = observable_nodes(DAG) - _set(X) - _set(Y) - De(DAG, Y)
+    G = surgery(DAG) # Compiled once for every candidate
     ivs = []
     for Z in possible_instruments:
-        W = ancestral_instrument(DAG, X, Y, Z)
+        W = ancestral_instrument(G, X, Y, Z)
         if W != '⊥':
             ivs.append((Z, W))
     return ivs
@@ -0,0 +1,283 @@
+"""Reading and writing causal diagrams: the dagitty, DOT and edge-list CSV
+text formats, and a compact binary format that is memory-mapped."""
+
+import csv
+import mmap
+import re
+import struct
+import sys
+from array import array
+import networkx as nx
+from oyster.diagram import CausalDiagram, FrozenCausalDiagram
+from oyster.utils.graph_utils import hidden_nodes, bidirected_edges
+
+
+### Text formats ###
+# dagitty and DOT share a syntax of statements: node declarations with
+# [attributes], chains of edges such as X -> M -> Y or {A B} -> Y, and
+# key=value settings, inside a header such as 'dag {' or 'digraph G {'.
+# DOT subgraphs, 'subgraph name { ... }' or '{ ... }', are read as their
+# statements, or as a group of nodes where they are the end of an edge.
+# Bidirected edges X <-> Y become a latent node U_X_Y with hidden edges
+# into X and Y, and undirected edges X -- Y give a CPDAG.
+_TOKEN = re.compile(r'''
+      \s+ | //[^\n]* | \#[^\n]* | /\*.*?\*/ # Whitespace and comments
+    | (?P<arrow><->|->|<-|--)
+    | (?P<quoted>"(?:[^"\\]|\\.)*")
+    | (?P<attrs>\[[^\]]*\])
+    | (?P<id>[\w.]+)
+    | (?P<punct>[{};,=])''', re.VERBOSE | re.DOTALL)
+_ATTR = re.compile(r'([\w.]+)\s*(?:=\s*("(?:[^"\\]|\\.)*"|[^,;\s\]]+))?')
+_IDENTIFIER = re.compile(r'[\w.]+')
+_HEADERS = {'strict', 'dag', 'pdag', 'mag', 'pag', 'graph', 'digraph'}
+_DEFAULTS = {'node', 'edge', 'graph'} # DOT statements setting default attributes
+
+def _unquote(token):
+    return token[1:-1].replace('\\"', '"') if token.startswith('"') else token
+
+def _quote(node):
+    node = str(node)
+    return node if _IDENTIFIER.fullmatch(node) else '"' + node.replace('"', '\\"') + '"'
+
+def _tokens(text):
+    """Return the (kind, value) tokens of a dagitty or DOT graph."""
+    tokens, position = [], 0
+    while position < len(text):
+        match = _TOKEN.match(text, position)
+        if match is None: raise ValueError(f'Cannot parse {text[position:position + 20]!r}')
+        if match.lastgroup == 'quoted': tokens.append(('id', _unquote(match.group())))
+        elif match.lastgroup: tokens.append((match.lastgroup, match.group()))
+        position = match.end()
+    return tokens
+
+def _attributes(token):
+    """Return the attributes in a [...] token, with True for bare keys."""
+    return {key: True if value == '' else _unquote(value)
+            for key, value in _ATTR.findall(token[1:-1])}
+
+def _is_true(value): return value is True or str(value).lower() in ('true', '1', 'yes')
+
+def _parse(text):
+    """Return the nodes (with attributes) and the directed, bidirected and
+    undirected edges of a dagitty or DOT graph."""
+    tokens = _tokens(text)
+    nodes, edges = {}, {'->': set(), '<->': set(), '--': set()}
+    def peek(i): return tokens[i] if i < len(tokens) else (None, None)
+    def subgraph(i):
+        """The i after the 'subgraph name {' or '{' at token i, or None."""
+        if peek(i)[0] == 'id' and peek(i)[1].lower() == 'subgraph':
+            i += 2 if peek(i + 1)[0] == 'id' else 1
+        return i + 1 if peek(i) == ('punct', '{') else None
+    def operand(i):
+        """The nodes of a node or {group} starting at token i, and the next i."""
+        start = subgraph(i)
+        if start is not None:
+            group, i = [], start
+            while peek(i)[0] == 'id':
+                group.append(peek(i)[1])
+                i += 1
+            if peek(i) != ('punct', '}'): raise ValueError('Unclosed group of nodes')
+            return group, i + 1
+        if peek(i)[0] != 'id': raise ValueError(f'Expected a node, found {peek(i)[1]!r}')
+        return [tokens[i][1]], i + 1
+
+    i = 0
+    while peek(i)[0] == 'id' and peek(i)[1] in _HEADERS: i += 1
+    if peek(i)[0] == 'id' and peek(i + 1) == ('punct', '{'): i += 1 # The graph's name
+    if peek(i) == ('punct', '{'): i += 1
+    while i < len(tokens):
+        kind, value = tokens[i]
+        if kind == 'punct' and value in ';,}':
+            i += 1
+            continue
+        if kind == 'id' and peek(i + 1) == ('punct', '='): # A key=value setting
+            i += 3
+            continue
+        if kind == 'id' and value in _DEFAULTS and peek(i + 1)[0] == 'attrs':
+            i += 2
+            continue
+        start = subgraph(i)
+        if start is not None: # Statements, unless a group of nodes in an edge
+            try: _, end = operand(i)
+            except ValueError: end = None
+            if end is None or peek(end)[0] not in ('arrow', 'attrs'):
+                i = start
+                continue
+        chain, arrows = [], []
+        group, i = operand(i)
+        chain.append(group)
+        while peek(i)[0] == 'arrow':
+            arrows.append(peek(i)[1])
+            group, i = operand(i + 1)
+            chain.append(group)
+        attrs = {}
+        if peek(i)[0] == 'attrs':
+            attrs = _attributes(peek(i)[1])
+            i += 1
+        for group in chain:
+            for v in group: nodes.setdefault(v, {})
+        if not arrows:
+            if _is_true(attrs.pop('latent', False)): attrs['hidden'] = True
+            for v in chain[0]: nodes[v].update(attrs)
+            continue
+        for A, arrow, B in zip(chain, arrows, chain[1:]):
+            arrow = {'both': '<->', 'none': '--'}.get(attrs.get('dir'), arrow)
+            for u in A:
+                for v in B:
+                    if arrow == '->': edges['->'].add((u, v))
+                    elif arrow == '<-': edges['->'].add((v, u))
+                    else: edges[arrow].add(tuple(sorted((u, v))))
+    return nodes, edges
+
+def _diagram(nodes, edges):
+    """Build a CausalDiagram, or a CPDAG if some edges are undirected."""
+    G = nx.DiGraph(cpdag=True) if edges['--'] else CausalDiagram()
+    G.add_nodes_from(nodes.items())
+    G.add_edges_from(edges['->'])
+    G.add_edges_from(e for u, v in edges['--'] for e in ((u, v), (v, u)))
+    for u, v in sorted(edges['<->']):
+        U, k = f'U_{u}_{v}', 1
+        while U in G: U, k = f'U_{u}_{v}_{k}', k + 1
+        G.add_edges_from([(U, u), (U, v)], hidden=True)
+    if not edges['--'] and not nx.is_directed_acyclic_graph(G):
+        raise ValueError('The graph has a directed cycle')
+    return G
+
+def from_dagitty(text):
+    """Return the CausalDiagram (or CPDAG) of a dagitty graph, like
+    'dag { U [latent] X -> M -> Y U -> X U -> Y }'."""
+    return _diagram(*_parse(text))
+
+def from_dot(text):
+    """Return the CausalDiagram (or CPDAG) of a DOT digraph. Nodes with
+    latent=true are hidden, and edges with dir=both are bidirected."""
+    return _diagram(*_parse(text))
+
+def _edge_kinds(G):
+    """Split the edges of G into directed, bidirected and undirected edges."""
+    directed, undirected = [], []
+    for u, v in G.edges:
+        if not G.has_edge(v, u): directed.append((u, v))
+        elif (v, u) not in undirected: undirected.append((u, v))
+    return directed, bidirected_edges(G), undirected
+
+def to_dagitty(G):
+    """Return G in dagitty syntax, with hidden nodes marked [latent]."""
+    hidden = hidden_nodes(G)
+    directed, bidirected, undirected = _edge_kinds(G)
+    lines = ['pdag {' if undirected else 'dag {']
+    lines += [_quote(v) + (' [latent]' if v in hidden else '') for v in G]
+    for edges, arrow in ((directed, '->'), (bidirected, '<->'), (undirected, '--')):
+        lines += [f'{_quote(u)} {arrow} {_quote(v)}' for u, v in edges]
+    return '\n'.join(lines) + '\n}\n'
+
+def to_dot(G):
+    """Return G as a DOT digraph, with hidden nodes marked latent=true."""
+    hidden = hidden_nodes(G)
+    directed, bidirected, undirected = _edge_kinds(G)
+    lines = ['digraph {']
+    lines += ['  ' + _quote(v) + (' [latent=true]' if v in hidden else '') + ';' for v in G]
+    for edges, attrs in ((directed, ''), (bidirected, ' [dir=both]'), (undirected, ' [dir=none]')):
+        lines += [f'  {_quote(u)} -> {_quote(v)}{attrs};' for u, v in edges]
+    return '\n'.join(lines) + '\n}\n'
+
+
+# Edge-list CSV: rows of source, target, edge (->, <-> or --) and hidden
+# (true if the source is latent). The last two columns are optional, and
+# an optional header names the columns.
+_CSV_HEADER = ['source', 'target', 'edge', 'hidden']
+
+def read_csv(path):
+    """Return the CausalDiagram (or CPDAG) of an edge-list CSV file."""
+    nodes, edges = {}, {'->': set(), '<->': set(), '--': set()}
+    with open(path, newline='') as f:
+        for row in csv.reader(f):
+            if not row or row[:2] == _CSV_HEADER[:2]: continue
+            u, v, arrow, hidden = (row + ['->', ''])[:4]
+            nodes.setdefault(u, {})
+            nodes.setdefault(v, {})
+            if _is_true(hidden): nodes[u]['hidden'] = True
+            if arrow == '->': edges['->'].add((u, v))
+            elif arrow in ('<->', '--'): edges[arrow].add(tuple(sorted((u, v))))
+            else: raise ValueError(f'Unknown edge {arrow!r} in {path}')
+    return _diagram(nodes, edges)
+
+def write_csv(G, path):
+    """Write the edges of G to an edge-list CSV file."""
+    hidden = hidden_nodes(G)
+    directed, bidirected, undirected = _edge_kinds(G)
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(_CSV_HEADER)
+        for edges, arrow in ((directed, '->'), (bidirected, '<->'), (undirected, '--')):
+            writer.writerows([u, v, arrow, 'true' if u in hidden else ''] for u, v in edges)
+
+
+### Binary format ###
+# A little-endian file of a header and 8-byte aligned sections: the parent
+# and child arrays of a FrozenCausalDiagram as int64, the bidirected edges
+# as pairs of node ids, a byte per node marking hidden nodes, and the node
+# names as NUL-separated UTF-8. Mapped into memory, the arrays are used in
+# place, so opening a file is fast and processes share its pages.
+_MAGIC = b'OYSTERDG'
+_VERSION = 1
+_ADMG = 1 # Header flag for graphs with a 'bidirected' adjacency
+_HEADER = struct.Struct('<8sIIQQQQ') # magic, version, flags, and the numbers of
+                                     # nodes, edges, bidirected edges and name bytes
+
+def _int64(values):
+    """Return values as a little-endian int64 array."""
+    values = array('q', values)
+    if sys.byteorder == 'big': values.byteswap()
+    return values
+
+def write_binary(G, path):
+    """Write G to path in the binary format. Node names must be strings."""
+    F = G if isinstance(G, FrozenCausalDiagram) else FrozenCausalDiagram(G)
+    if F.removed: F = F.subgraph(F.nodes) # Compile the surgery into the arrays
+    if not all(isinstance(v, str) and '\0' not in v for v in F.names):
+        raise TypeError('The binary format stores node names that are strings without NUL')
+    pairs = [F.ids[v] for edge in bidirected_edges(F) for v in edge]
+    names = '\0'.join(F.names).encode('utf-8')
+    n, m = len(F.names), len(F._pa)
+    with open(path, 'wb') as f:
+        f.write(_HEADER.pack(_MAGIC, _VERSION, _ADMG if 'bidirected' in F.graph else 0,
+                             n, m, len(pairs) // 2, len(names)))
+        for section in (F._pa_ptr, F._pa, F._ch_ptr, F._ch, F._ch_edge, pairs):
+            f.write(_int64(section).tobytes())
+        f.write(bytes(F.hidden) + bytes(-n % 8))
+        f.write(names)
+
+def read_binary(path, memory_map=True):
+    """Return the FrozenCausalDiagram in a binary file, with its arrays
+    mapped into memory unless memory_map=False."""
+    with open(path, 'rb') as f:
+        if memory_map: data = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        else: data = memoryview(f.read())
+    magic, version, flags, n, m, b, name_size = _HEADER.unpack_from(data)
+    if magic != _MAGIC: raise ValueError(f'{path} is not an oyster diagram file')
+    if version != _VERSION: raise ValueError(f'{path} has unsupported version {version}')
+    offset = _HEADER.size
+    def section(size):
+        nonlocal offset
+        view, offset = data[offset:offset + size], offset + size
+        return view
+    def int64(count):
+        view = section(8 * count)
+        if sys.byteorder == 'little': return view.cast('q')
+        values = array('q', bytes(view))
+        values.byteswap()
+        return values
+    pa_ptr, pa, ch_ptr, ch, ch_edge = int64(n + 1), int64(m), int64(n + 1), int64(m), int64(m)
+    pairs = int64(2 * b)
+    hidden = section(n + -n % 8)[:n]
+    names = bytes(section(name_size)).decode('utf-8').split('\0') if n else []
+    graph = {}
+    if flags & _ADMG:
+        graph['bidirected'] = bidirected = {}
+        for k in range(0, 2 * b, 2):
+            u, v = names[pairs[k]], names[pairs[k + 1]]
+            bidirected.setdefault(u, set()).add(v)
+            bidirected.setdefault(v, set()).add(u)
+    return FrozenCausalDiagram._from_arrays(names, hidden, graph,
+                                            pa_ptr, pa, ch_ptr, ch, ch_edge)
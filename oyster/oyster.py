@@ -2,15 +2,17 @@
 
 import networkx as nx
 from oyster.utils.graph_utils import NA_pairs, De, Pa
-from oyster.utils.set_utils import minimal_sets
-from oyster.adjust import d_separated, d_separator_search
-from oyster.viz.viz import draw
+from oyster.adjust import minimal_d_separators
 
-def implied_independencies(DAG):
+def iter_implied_independencies(DAG, max_separators=None):
+    """Generate (X, Y, minimal d-separators) for every nonadjacent pair 
+    X, Y in DAG, listing at most max_separators separators per pair."""
+    for X, Y in NA_pairs(DAG):
+        yield X, Y, minimal_d_separators(DAG, X, Y, max_separators)
+
+def implied_independencies(DAG, max_separators=None):
     print('Implied independencies:')
-    ind = {(X, Y): minimal_sets(d_separator_search(DAG, X, Y))
-           for X, Y in NA_pairs(DAG)}
-    for (X, Y), minsets in ind.items():
+    for X, Y, minsets in iter_implied_independencies(DAG, max_separators):
            print(f'{X} ⫫ {Y} | {minsets}')
 
 def basis_set(DAG):
@@ -1,23 +1,82 @@
 """Definitions of causal structures in causal diagrams."""
 
 import networkx as nx
-from oyster.utils.graph_utils import observable_nodes, observable_pairs, De
+from collections import namedtuple
+from oyster.utils.graph_utils import (observable_nodes, observable_pairs, An, De,
+                                      hidden_nodes, bidirected_neighbors)
+from oyster.utils.set_utils import _set
+from oyster.utils.profiling import instrumented
 
-def paths(DAG, X, Y, directed=False):
-    """Return a generator of all paths in DAG from X to Y.
-    """
-    def reorient_path(DAG, path_list):
-        """Map a list of nodes specifying an undirected path back to a DAG 
-        to recover the original edge orientation and data."""
-        pairs = zip(path_list, path_list[1:])
-        edges = []
-        for (u,v) in pairs:
-            if DAG.has_edge(u,v): edges.append((u,v, DAG.get_edge_data(u,v)))
-            else: edges.append((v,u, DAG.get_edge_data(v,u)))
-        return nx.DiGraph(edges)
-    G = DAG if directed else nx.to_undirected(DAG) 
-    paths = nx.all_simple_paths(G, X, Y) 
-    return (reorient_path(DAG, path) for path in paths)
+class Path(namedtuple('Path', ['nodes', 'forward', 'bidirected'])):
+    """A path as a tuple of nodes and integers of direction bits: bit i of
+    forward is set if the i-th edge points from nodes[i] to nodes[i+1], and
+    bit i of bidirected if it is a bidirected edge of an ADMG, which points
+    both ways (its forward bit is set too)."""
+    __slots__ = ()
+    
+    def __new__(cls, nodes, forward, bidirected=0):
+        return super().__new__(cls, nodes, forward, bidirected)
+    
+    def edges(self):
+        """Return a list of the directed edges of the path as they point in 
+        the graph."""
+        return [(u, v) if self.forward >> i & 1 else (v, u) 
+                for i, (u, v) in enumerate(zip(self.nodes, self.nodes[1:]))
+                if not self.bidirected >> i & 1]
+    
+    def bidirected_edges(self):
+        """Return a list of the bidirected edges of the path, in its order."""
+        return [(u, v) for i, (u, v) in enumerate(zip(self.nodes, self.nodes[1:]))
+                if self.bidirected >> i & 1]
+
+@instrumented
+def paths(DAG, X, Y, directed=False, Z=None, max_length=None, max_paths=None):
+    """Return a generator of the simple paths in DAG from X to Y, as Paths.
+    
+    With directed=True only directed paths are generated. Given a set Z, 
+    only the paths that are open (d-connecting) given Z are generated, and 
+    a prefix is abandoned as soon as it is blocked. max_length limits the 
+    number of edges of a path and max_paths the number of paths. In an 
+    ADMG, paths also follow bidirected edges, and are open given Z as in 
+    m-separation. In an undirected graph every edge is followed forward, 
+    so there are no colliders."""
+    Z = None if Z is None else _set(Z)
+    if hasattr(DAG, 'succ'): out, into = DAG.succ, DAG.pred
+    else: out, into = DAG.adj, None # An undirected nx.Graph
+    open_colliders = None if Z is None or into is None else An(DAG, Z) | Z
+    FORWARD, BACKWARD, BIDIRECTED = 1, 0, 2 # Each edge's arrowhead: at its end, start, both
+    def steps(v):
+        yield from ((w, FORWARD) for w in out[v])
+        if directed or into is None: return
+        yield from ((w, BACKWARD) for w in into[v])
+        yield from ((w, BIDIRECTED) for w in bidirected_neighbors(DAG, v))
+    def blocked(v, into_v, out_of_v):
+        if into_v and not out_of_v: return v not in open_colliders # Collider
+        return v in Z
+    
+    nodes, marks, on_path = [X], [], {X}
+    stack, found = [steps(X)], 0
+    while stack:
+        for w, mark in stack[-1]:
+            if w in on_path: continue
+            if (Z is not None and marks and 
+                blocked(nodes[-1], marks[-1] != BACKWARD, mark == FORWARD)): continue
+            if w == Y:
+                edges = marks + [mark]
+                yield Path(tuple(nodes) + (Y,), 
+                           sum((m != BACKWARD) << i for i, m in enumerate(edges)),
+                           sum((m == BIDIRECTED) << i for i, m in enumerate(edges)))
+                found += 1
+                if found == max_paths: return
+                continue
+            if max_length is not None and len(marks) + 2 > max_length: continue
+            nodes.append(w); marks.append(mark); on_path.add(w)
+            stack.append(steps(w))
+            break
+        else: # No more steps from the end of the path
+            stack.pop()
+            on_path.discard(nodes.pop())
+            if marks: marks.pop()
 
 def root_set(DAG):
     """The root set of the DAG, i.e. nodes without children.
@@ -43,36 +102,62 @@ def is_tree(DAG):
     is called a tree."""
     return is_forest(DAG) and len(root_set(DAG)) == 1
 
-def is_confounded(path):
-    """
-    path is assumed to be an nx.DiGraph representing a path
-    A path where all directed arrowheads point at observable nodes, 
-    and never away from observable nodes is called a confounded path."""
-    arrowheads_in, arrowheads_out = [], []
-    for u,v in path.edges():
-        arrowheads_in.append(v)
-        arrowheads_out.append(u)
-    return (all([i in observable_nodes(path) for i in arrowheads_in]) and
-        not any([o in observable_nodes(path) for o in arrowheads_out]))
+def is_confounded(DAG, path=None):
+    """Return if path, a Path in DAG, is a confounded path: one where all 
+    directed arrowheads point at observable nodes, and never away from 
+    observable nodes (bidirected edges always qualify). The path alone, as a DiGraph of its edges and their
+    hidden nodes, is accepted too: is_confounded(path)."""
+    if path is None: path = DAG
+    hidden = hidden_nodes(DAG)
+    return all(u in hidden and v not in hidden for u, v in path.edges())
+
+def _confounded_component(DAG, nodes, hidden, expanded):
+    """Return the observable nodes linked to any of nodes by a confounded 
+    path, i.e. by shared hidden parents or bidirected edges, in one 
+    traversal. Hidden nodes in expanded are not traversed again."""
+    component, stack = set(nodes), list(nodes)
+    while stack:
+        v = stack.pop()
+        linked = bidirected_neighbors(DAG, v)
+        for h in DAG.pred[v]:
+            if h in hidden and h not in expanded:
+                expanded.add(h)
+                linked.update(c for c in DAG.succ[h] if c not in hidden)
+        for c in linked - component:
+            component.add(c)
+            stack.append(c)
+    return component
+
+def confounded_nodes(DAG, X):
+    """Return the set of observable nodes linked to X by a confounded path."""
+    X = _set(X)
+    return _confounded_component(DAG, X, hidden_nodes(DAG), set()) - X
 
 def has_confounded_path(DAG, X, Y):
     "Return if there is at least one confounded path between X and Y in DAG."
-    return any((is_confounded(path) for path in paths(DAG, X, Y)))
+    return Y in confounded_nodes(DAG, X)
 
 def is_c_component(DAG):
     """Return if the graph is a c-component.
     From Shpitser 2008: a graph where any pair of observable 
     nodes is connected by a confounded path is called a 
     c-component (confounded component)."""
-    return all((has_confounded_path(DAG, u, v) for u,v in observable_pairs(DAG)))
+    return len(c_components(DAG)) <= 1
         
+@instrumented
 def c_components(DAG):
-    """Return a list of the maximal c-component node sets in DAG."""
-    G = nx.Graph(); 
-    G.add_nodes_from(observable_nodes(DAG))
-    G.add_edges_from([(u,v) for u,v in observable_pairs(DAG) if 
-                      has_confounded_path(DAG, u, v)])
-    return list(nx.connected_components(G))
+    """Return a list of the maximal c-component node sets in DAG.
+    
+    Observable nodes are linked by a shared hidden parent or, in an ADMG,
+    a bidirected edge; the components are found in one O(|V|+|E|) pass."""
+    hidden = hidden_nodes(DAG)
+    components, assigned, expanded = [], set(), set()
+    for node in observable_nodes(DAG):
+        if node in assigned: continue
+        component = _confounded_component(DAG, {node}, hidden, expanded)
+        assigned |= component
+        components.append(component)
+    return components
 
 def is_c_tree(DAG):
     return is_c_component(DAG) and is_tree(DAG)
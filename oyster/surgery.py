@@ -0,0 +1,137 @@
+"""Graph surgery: mutilated DAGs as edge bitmasks over a compiled DAG."""
+
+import networkx as nx
+from collections.abc import Mapping
+from oyster.diagram import FrozenCausalDiagram
+from oyster.utils.graph_utils import _cached
+from oyster.utils.set_utils import _set
+
+
+class CompiledGraph:
+    """The nodes and edges of a DAG numbered once, with the bitmask of
+    the edges into and out of every node, so that surgeries on the DAG
+    are integer bitmasks of removed edges."""
+    def __init__(self, DAG):
+        self.DAG = DAG
+        self.nodes = list(DAG)
+        self.ids = {v: i for i, v in enumerate(self.nodes)}
+        self.edges = list(DAG.edges())
+        self.edge_ids = {edge: e for e, edge in enumerate(self.edges)}
+        n = len(self.nodes)
+        self.parents, self.children = [[] for _ in range(n)], [[] for _ in range(n)]
+        for e, (u, v) in enumerate(self.edges):
+            self.parents[self.ids[v]].append((u, e))
+            self.children[self.ids[u]].append((v, e))
+        self.into, self.out = {}, {} # node -> edge mask, built when needed
+
+    def mask(self, masks, rows, nodes):
+        """Return the union of the edge masks of nodes, building those of
+        the edges in rows (parents or children) as needed."""
+        mask = 0
+        for v in _set(nodes):
+            if v not in masks:
+                masks[v] = sum(1 << e for _, e in rows[self.ids[v]])
+            mask |= masks[v]
+        return mask
+
+def _edge_ids(mask):
+    """Return the set of edge ids in mask."""
+    digits = bin(mask)[:1:-1] # Least significant first
+    return {e for e, digit in enumerate(digits) if digit == '1'}
+
+
+class _Adjacency(Mapping):
+    """The parents or children of each node of a Surgery, like DAG.pred
+    or DAG.succ."""
+    def __init__(self, surgery, rows):
+        self.surgery, self.rows = surgery, rows
+    def __getitem__(self, node):
+        removed = self.surgery.removed_ids
+        return [v for v, e in self.rows[self.surgery.compiled.ids[node]]
+                if e not in removed]
+    def __iter__(self): return iter(self.surgery.compiled.nodes)
+    def __len__(self): return len(self.surgery.compiled.nodes)
+
+
+class Surgery:
+    """A DAG with some of its edges removed, as a bitmask of removed edges.
+
+    Surgeries compose with one OR of their masks, and each do(X), 
+    backdoor(X) or without(edges) ORs in the masks of X or the edges, 
+    however many surgeries are stacked.
+    A Surgery has the pred, succ and nodes of a graph, so d-separation
+    and the node selectors accept it. to_graph() returns the surgery as
+    an nx.DiGraph for identification, moral graphs and drawing."""
+    def __init__(self, compiled, removed=0):
+        self.compiled, self.removed = compiled, removed
+        self._removed_ids = None
+        self.pred = _Adjacency(self, compiled.parents)
+        self.succ = _Adjacency(self, compiled.children)
+
+    @property
+    def removed_ids(self):
+        if self._removed_ids is None: self._removed_ids = _edge_ids(self.removed)
+        return self._removed_ids
+
+    # Surgeries
+    def do(self, X):
+        """Return this surgery with the edges into X removed as well."""
+        compiled = self.compiled
+        return Surgery(compiled, self.removed | compiled.mask(compiled.into, compiled.parents, X))
+
+    def backdoor(self, X):
+        """Return this surgery with the edges out of X removed as well."""
+        compiled = self.compiled
+        return Surgery(compiled, self.removed | compiled.mask(compiled.out, compiled.children, X))
+
+    def without(self, edges):
+        """Return this surgery with edges removed as well, ignoring
+        those that are not in the DAG."""
+        mask = 0
+        for edge in edges:
+            e = self.compiled.edge_ids.get(tuple(edge))
+            if e is not None: mask |= 1 << e
+        return Surgery(self.compiled, self.removed | mask)
+
+    def __or__(self, other):
+        """The surgery removing the edges removed by either surgery."""
+        return Surgery(self.compiled, self.removed | other.removed)
+
+    # The graph interface
+    @property
+    def _graph(self): return self.compiled.DAG # So hidden_nodes sees the edges
+    @property
+    def graph(self): return self.compiled.DAG.graph
+    @property
+    def nodes(self): return self.compiled.DAG.nodes
+    @property
+    def edges(self):
+        removed = self.removed_ids
+        return [edge for e, edge in enumerate(self.compiled.edges) if e not in removed]
+    def has_edge(self, u, v):
+        e = self.compiled.edge_ids.get((u, v))
+        return e is not None and e not in self.removed_ids
+    def __iter__(self): return iter(self.compiled.nodes)
+    def __contains__(self, node): return node in self.compiled.ids
+    def __len__(self): return len(self.compiled.nodes)
+
+    def to_graph(self):
+        """Return the surgery as an nx.DiGraph, keeping node and edge data."""
+        DAG = self.compiled.DAG
+        G = nx.DiGraph()
+        G.graph.update(DAG.graph)
+        G.add_nodes_from(DAG.nodes(data=True))
+        G.add_edges_from((u, v, DAG.edges[u, v]) for u, v in self.edges)
+        return G
+
+    def subgraph(self, nodes):
+        """Return the subgraph of the surgery induced by nodes."""
+        return self.to_graph().subgraph(nodes)
+
+
+def surgery(DAG):
+    """Return DAG, compiled once per CausalDiagram, as a Surgery with no
+    edges removed. Returns surgeries and FrozenCausalDiagrams, which have
+    the same surgeries, as they are."""
+    if isinstance(DAG, (Surgery, FrozenCausalDiagram)): return DAG
+    return Surgery(_cached(DAG, ('compiled',), lambda: CompiledGraph(DAG)))
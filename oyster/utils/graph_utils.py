@@ -1,7 +1,10 @@
 """Utility functions for working with graphical causal models."""
 import networkx as nx
 from oyster.utils.set_utils import _set
+from oyster.utils.profiling import instrumented
+from oyster.diagram import CausalDiagram, FrozenCausalDiagram
 from itertools import chain, combinations
+from collections import deque
 
 
 ### Wrappers ###
@@ -23,31 +26,81 @@ def equal(G, F):
     return (G.nodes() == F.nodes() and G.edges() == F.edges())
 
 
+### Caching ###
+# A CausalDiagram (or view of one) caches results until it is changed.
+def _cached(DAG, key, compute):
+    """Return compute(), cached under key if DAG is a CausalDiagram."""
+    cached = getattr(DAG, 'cached', None)
+    return compute() if cached is None else cached(key, compute)
+
+def _cached_set(DAG, name, nodes, compute):
+    """Return a copy of the set compute(), cached under (name, nodes)."""
+    if not hasattr(DAG, 'cached'): return compute()
+    return set(DAG.cached((name, frozenset(_set(nodes))), 
+                          lambda: frozenset(compute())))
+
+
 ### Node Selectors ###
+# Each selector uses the diagram's ReachabilityIndex when one has been built,
+# and the native traversals of a FrozenCausalDiagram.
+def _index(DAG):
+    """Return the ReachabilityIndex attached to DAG, if any, or DAG if it
+    is a FrozenCausalDiagram, which has the same selectors."""
+    if isinstance(DAG, FrozenCausalDiagram): return DAG
+    return getattr(DAG, '_reachability', None)
+
+def _closure(adjacency, nodes, avoid=()):
+    """Set of the nodes reached from nodes in one or more steps along 
+    adjacency (DAG.succ or DAG.pred), never entering avoid."""
+    reached, stack = set(), list(_set(nodes))
+    while stack:
+        for v in adjacency[stack.pop()]:
+            if v not in reached and v not in avoid:
+                reached.add(v)
+                stack.append(v)
+    return reached
+
 def De(DAG, nodes):
     """Set of the descendants of nodes in DAG."""
-    return _vectorize_union(nx.descendants)(DAG, nodes)
+    index = _index(DAG)
+    if index: return index.descendants(nodes)
+    return _cached_set(DAG, 'De', nodes, lambda: _closure(DAG.succ, nodes))
 
 def An(DAG, nodes):
     """Set of the ancestors of nodes in DAG."""
-    return _vectorize_union(nx.ancestors)(DAG, nodes)
+    index = _index(DAG)
+    if index: return index.ancestors(nodes)
+    return _cached_set(DAG, 'An', nodes, lambda: _closure(DAG.pred, nodes))
 
 def Ch(DAG, nodes):
     """Set of the children of nodes in DAG."""
+    index = _index(DAG)
+    if index: return index.children(nodes)
     def children(DAG, node): return DAG.successors(node) 
-    return _vectorize_union(children)(DAG, nodes)
+    return _cached_set(DAG, 'Ch', nodes, lambda: _vectorize_union(children)(DAG, nodes))
 
 def Pa(DAG, nodes):
     """Set of the parents of nodes in DAG."""
+    index = _index(DAG)
+    if index: return index.parents(nodes)
     def parents(DAG, node): return DAG.predecessors(node) 
-    return _vectorize_union(parents)(DAG, nodes)
+    return _cached_set(DAG, 'Pa', nodes, lambda: _vectorize_union(parents)(DAG, nodes))
 
 def MB(DAG, nodes): 
     """Markov Blanket of a node in DAG.
     The set of parents, children, and parents of children."""
+    index = _index(DAG)
+    if index: return index.markov_blanket(nodes)
     def mb(DAG, node): 
         return set(Pa(DAG, node) | Ch(DAG, node) | Pa(DAG, Ch(DAG, node))) - {node}
-    return _vectorize_union(mb)(DAG, nodes)
+    return _cached_set(DAG, 'MB', nodes, lambda: _vectorize_union(mb)(DAG, nodes))
+
+def proper_causal_nodes(DAG, X, Y):
+    """Set of the nodes other than X on proper causal paths from X to Y in 
+    DAG: directed paths that meet X only at their start."""
+    X, Y = _set(X), _set(Y)
+    return set(_cached(DAG, ('proper_causal_nodes', frozenset(X), frozenset(Y)), lambda: 
+                       frozenset(_closure(DAG.succ, X, X) & (_closure(DAG.pred, Y, X) | Y))))
 
 def NA(DAG, nodes):
     """Set of non-adjacent nodes to given nodes in DAG."""
@@ -62,16 +115,72 @@ def hidden_edges(DAG):
             if d.get('hidden') == True]
 
 def hidden_nodes(DAG):
-    """Return a set of the hidden nodes in DAG."""
-    #return {u for u,v,d in DAG.edges(data=True) if (d.get('hidden') == True} 
-    # HACK: requires hidden nodes named 'U'
-    return {node for node in DAG.nodes() if 'U' in node}
+    """Return a set of the hidden nodes in DAG: nodes with a hidden=True
+    attribute and the tails of hidden edges."""
+    if isinstance(DAG, FrozenCausalDiagram): return DAG.hidden_nodes()
+    G = DAG 
+    while hasattr(G, '_graph'): G = G._graph # Subgraph views may hide the edges
+    hidden = ({u for u,v,d in G.edges(data=True) if d.get('hidden') == True} |
+              {v for v,d in G.nodes(data=True) if d.get('hidden') == True})
+    return hidden & DAG.nodes() if G is not DAG else hidden
 
 def observable_nodes(DAG):
     """Return a set of the observable nodes in DAG."""
     return DAG.nodes() - hidden_nodes(DAG)
 
 
+# Acyclic directed mixed graphs (ADMGs):
+# An ADMG keeps its bidirected edges as an adjacency dict in 
+# G.graph['bidirected'], which subgraph views share with their graph.
+def is_admg(G):
+    """Return if G represents latent confounding with bidirected edges."""
+    return 'bidirected' in G.graph
+
+def bidirected_neighbors(G, node):
+    """Set of the nodes joined to node by a bidirected edge in G."""
+    return {v for v in G.graph.get('bidirected', {}).get(node, ()) if v in G}
+
+def bidirected_edges(G):
+    """Return a list of the bidirected edges in G, each listed once."""
+    seen, edges = set(), []
+    for u in G.graph.get('bidirected', {}):
+        if u not in G: continue
+        seen.add(u)
+        edges.extend((u, v) for v in bidirected_neighbors(G, u) if v not in seen)
+    return edges
+
+def latent_projection(DAG):
+    """Return the ADMG over the observable nodes of DAG (Verma and Pearl 1990).
+    
+    u -> v if DAG has a directed path from u to v through hidden nodes only, 
+    and u <-> v if some hidden node has such paths to both u and v."""
+    hidden = hidden_nodes(DAG)
+    def observable_reach(node):
+        """Observable nodes reached from node through hidden nodes only."""
+        reached, seen, stack = set(), set(), list(DAG.succ[node])
+        while stack:
+            v = stack.pop()
+            if v in seen: continue
+            seen.add(v)
+            if v in hidden: stack.extend(DAG.succ[v])
+            else: reached.add(v)
+        return reached
+    
+    G = CausalDiagram()
+    G.graph.update(DAG.graph)
+    G.add_nodes_from((v, d) for v, d in DAG.nodes(data=True) if v not in hidden)
+    for u in list(G):
+        G.add_edges_from((u, v, DAG.get_edge_data(u, v, {})) 
+                         for v in observable_reach(u))
+    bidirected = {v: set(nbrs) for v, nbrs in DAG.graph.get('bidirected', {}).items()}
+    for h in hidden:
+        confounded = observable_reach(h)
+        for v in confounded:
+            bidirected.setdefault(v, set()).update(confounded - {v})
+    G.graph['bidirected'] = bidirected
+    return G
+
+
 ### Node Pairings ###
 def are_nonadjacent(G, nodes):
     for node in nodes:
@@ -81,7 +190,7 @@ def are_nonadjacent(G, nodes):
 def NA_pairs(DAG):
     "List of all nonadjacent pairs of nodes in DAG."
     return [set((X, Y)) for X,Y in combinations(DAG.nodes, 2)
-            if Y not in set(DAG.to_undirected()[X])]
+            if not (DAG.has_edge(X, Y) or DAG.has_edge(Y, X))]
 
 def observable_pairs(DAG):
     """An iterator of observable pairs of nodes in DAG."""
@@ -89,19 +198,130 @@ def observable_pairs(DAG):
 
 
 ### Subgraphs ###
+@instrumented
 def ancestral_graph(DAG, nodes):
     """A subgraph of the DAG containing only the specified nodes and their ancestors."""
-    return DAG.subgraph(An(DAG, nodes) | set(nodes))
-
-from networkx.algorithms.moral import moral_graph
-
+    return _cached(DAG, ('ancestral_graph', frozenset(_set(nodes))),
+                   lambda: DAG.subgraph(An(DAG, nodes) | _set(nodes)))
+
+@instrumented
+def moral_graph(DAG):
+    """Return the moral graph of DAG, frozen if a CausalDiagram caches it.
+    
+    For an ADMG this is the augmented graph (Richardson 2003), in which 
+    each district (bidirected component) is married with its parents, so 
+    that m-separation in an ancestral ADMG is separation in it."""
+    def moral():
+        M = DAG.moral_graph() if isinstance(DAG, FrozenCausalDiagram) else nx.moral_graph(DAG)
+        for district in _districts(DAG):
+            M.add_edges_from(combinations(district | Pa(DAG, district), 2))
+        return M
+    if getattr(DAG, 'cached', None) is None: return moral()
+    return DAG.cached(('moral_graph',), lambda: nx.freeze(moral()))
+
+def _districts(G):
+    """Generate the districts of the ADMG G with more than one node."""
+    seen = set()
+    for v in G.graph.get('bidirected', {}):
+        if v in seen or v not in G: continue
+        district, stack = {v}, [v]
+        while stack:
+            for w in bidirected_neighbors(G, stack.pop()) - district:
+                district.add(w)
+                stack.append(w)
+        seen |= district
+        if len(district) > 1: yield district
+
+@instrumented
 def backdoor_graph(DAG, X):
     """Return the subgraph of DAG with arrows from nodes X removed."""
-    return nx.subgraph_view(DAG, filter_edge=lambda a, b: a not in _set(X))
-
+    X = frozenset(_set(X))
+    if isinstance(DAG, FrozenCausalDiagram): 
+        return _cached(DAG, ('backdoor_graph', X), lambda: DAG.backdoor(X))
+    return _cached(DAG, ('backdoor_graph', X), lambda: 
+                   nx.subgraph_view(DAG, filter_edge=lambda a, b: a not in X))
+
+def proper_backdoor_graph(DAG, X, Y):
+    """Return the subgraph of DAG with the first arrow of every proper causal 
+    path from X to Y removed (Perković et al. 2018)."""
+    X, causal = _set(X), proper_causal_nodes(DAG, X, Y)
+    if isinstance(DAG, FrozenCausalDiagram):
+        return _cached(DAG, ('proper_backdoor_graph', frozenset(X), frozenset(causal)), lambda:
+                       DAG.without((x, c) for x in X for c in DAG.succ[x] if c in causal))
+    return _cached(DAG, ('proper_backdoor_graph', frozenset(X), frozenset(causal)), lambda:
+                   nx.subgraph_view(DAG, filter_edge=lambda a, b: a not in X or b not in causal))
+
+@instrumented
 def do_X(DAG, X):
     """Return the subgraph of DAG with arrows into nodes X removed."""
-    return nx.subgraph_view(DAG, filter_edge=lambda a, b: b not in _set(X))
+    X = frozenset(_set(X))
+    if isinstance(DAG, FrozenCausalDiagram): return _cached(DAG, ('do_X', X), lambda: DAG.do(X))
+    def view():
+        view = nx.subgraph_view(DAG, filter_edge=lambda a, b: b not in X)
+        if is_admg(DAG): # Bidirected edges have an arrow into X too
+            view.graph = dict(DAG.graph, bidirected={
+                v: nbrs - X for v, nbrs in DAG.graph['bidirected'].items() if v not in X})
+        return view
+    return _cached(DAG, ('do_X', X), view)
+
+
+### Undirected Separators ###
+def minimal_vertex_separators(G, S, T, allowed=None):
+    """Generate the minimal sets of nodes separating nodes S from nodes T
+    in the undirected graph G, using only nodes in allowed (default: all).
+    
+    Each separator is listed once, in polynomial time per separator, by 
+    the close-separator expansion of Kloks and Kratsch 1998. Nodes outside
+    allowed are eliminated first (their neighborhood made a clique), which 
+    preserves separation by sets of allowed nodes."""
+    S, T = _set(S), _set(T)
+    if S & T: return
+    s, t = object(), object() # Merged source and sink
+    adj = {v: set(G[v]) for v in G.nodes - S - T}
+    adj[s] = set().union(*(G[v] for v in S)) - S
+    adj[t] = set().union(*(G[v] for v in T)) - T
+    if adj[s] & T: return
+    for v in adj[s]: adj[v] = (adj[v] - S) | {s}
+    for v in adj[t]: adj[v] = (adj[v] - T) | {t}
+    
+    allowed = adj.keys() - {s, t} if allowed is None else _set(allowed)
+    for f in list(adj.keys() - {s, t} - allowed):
+        neighbors = adj.pop(f)
+        for v in neighbors:
+            adj[v] |= neighbors - {v}
+            adj[v].discard(f)
+    if t in adj[s]: return
+
+    def component(start, blocked):
+        seen, stack = {start}, [start]
+        while stack:
+            for w in adj[stack.pop()]:
+                if w not in seen and w not in blocked:
+                    seen.add(w)
+                    stack.append(w)
+        return seen
+    
+    def neighborhood(nodes):
+        return set().union(*(adj[v] for v in nodes)) - nodes
+    
+    def close_to(D):
+        """The minimal separator closest to D on the side of t."""
+        return frozenset(neighborhood(component(t, D | neighborhood(D))))
+
+    first = close_to({s})
+    found, queue = {first}, deque([first])
+    yield set(first)
+    while queue:
+        separator = queue.popleft()
+        C = component(s, separator)
+        for x in separator:
+            D = C | {x}
+            if t in adj[x]: continue
+            new = close_to(D)
+            if new not in found:
+                found.add(new)
+                queue.append(new)
+                yield set(new)
 
 
 ### Graph Transformations ###
@@ -115,6 +335,8 @@ def bidirected(DAG):
 
 def edges_removed(DAG, edges):
     """Return a view of the DAG with given edges removed."""
+    edges = frozenset(edges)
+    if isinstance(DAG, FrozenCausalDiagram): return DAG.without(edges)
     def not_in_edges(u,v): return (u,v) not in edges
     return nx.subgraph_view(DAG, filter_edge=not_in_edges)
 
@@ -0,0 +1,190 @@
+"""Opt-in counts and timings of oyster's hot paths.
+
+Instrumented functions (d_separated, the subgraph constructions, paths,
+c_components, the set searches and identification) count their calls and
+time spent, and searches and algorithm ID count events such as subsets
+examined and ID lines, while a Profile is active:
+
+    with profile() as p:
+        adjusters(G, 'X', 'Y')
+    p.as_dict()
+
+or for a whole process with the environment variable OYSTER_PROFILE: 1
+prints a JSON line to stderr at exit, a path ending in .prof gets a
+cProfile-compatible stats file (for pstats or snakeviz), and any other
+path gets a JSON line appended. When no Profile is active, instrumented
+functions cost one check of a global."""
+
+import atexit
+import json
+import marshal
+import os
+import sys
+import threading
+import time
+from functools import wraps
+from inspect import isgeneratorfunction
+
+_profile = None # The active Profile
+
+
+class Profile:
+    """The calls, time and events of instrumented functions.
+
+    Times are wall-clock seconds: cumulative, and self time excluding the
+    instrumented functions called. Events are counted for every
+    instrumented function running when they happen, and under '' too.
+    A generator's time is the time spent resuming it."""
+    def __init__(self):
+        self.functions = {} # label -> [name, calls, primitive calls, self, cumulative, callers]
+        self.events = {}    # function name -> {event: count}
+        self._maxima = set() # The events recorded by maximum
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _frames(self):
+        """The stack of [label, name, time in instrumented callees] of this thread."""
+        if not hasattr(self._local, 'frames'): self._local.frames = []
+        return self._local.frames
+
+    def call(self, label, name, function, args, kwargs, calls=1):
+        """Call function(*args, **kwargs), recording its time under label."""
+        frames = self._frames()
+        frames.append([label, name, 0.0])
+        start = time.perf_counter()
+        try: return function(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            _, _, callees = frames.pop()
+            if frames: frames[-1][2] += elapsed
+            recursive = any(frame[0] == label for frame in frames)
+            caller = frames[-1][0] if frames else None
+            with self._lock:
+                stats = self.functions.setdefault(label, [name, 0, 0, 0.0, 0.0, {}])
+                stats[1] += calls
+                stats[2] += calls and not recursive
+                stats[3] += elapsed - callees
+                if not recursive: stats[4] += elapsed
+                if caller is not None:
+                    n, c, tt, ct = stats[5].get(caller, (0, 0, 0.0, 0.0))
+                    stats[5][caller] = (n + calls, c + calls, tt + elapsed - callees, ct + elapsed)
+
+    def count(self, event, n=1):
+        """Count n events in every running instrumented function."""
+        with self._lock:
+            for owner in {frame[1] for frame in self._frames()} | {''}:
+                counts = self.events.setdefault(owner, {})
+                counts[event] = counts.get(event, 0) + n
+
+    def maximum(self, event, value):
+        """Record the largest value of event, such as a recursion depth."""
+        with self._lock:
+            self._maxima.add(event)
+            for owner in {frame[1] for frame in self._frames()} | {''}:
+                counts = self.events.setdefault(owner, {})
+                counts[event] = max(counts.get(event, value), value)
+
+    def merge(self, other):
+        """Add the records of another Profile to this one."""
+        with self._lock:
+            for label, (name, n, c, tt, ct, callers) in other.functions.items():
+                stats = self.functions.setdefault(label, [name, 0, 0, 0.0, 0.0, {}])
+                stats[1] += n; stats[2] += c; stats[3] += tt; stats[4] += ct
+                for caller, values in callers.items():
+                    stats[5][caller] = tuple(map(sum, zip(stats[5].get(caller, (0, 0, 0.0, 0.0)),
+                                                          values)))
+            self._maxima |= other._maxima
+            for owner, counts in other.events.items():
+                mine = self.events.setdefault(owner, {})
+                for event, n in counts.items():
+                    mine[event] = (max(mine.get(event, n), n) if event in self._maxima
+                                   else mine.get(event, 0) + n)
+
+    # Exports
+    def as_dict(self):
+        """Return the calls, cumulative and self seconds of each function
+        (by name), and the events counted in each."""
+        functions = {}
+        for name, n, _, tt, ct, _ in self.functions.values():
+            stats = functions.setdefault(name, {'calls': 0, 'seconds': 0.0, 'self_seconds': 0.0})
+            stats['calls'] += n
+            stats['seconds'] += ct
+            stats['self_seconds'] += tt
+        return {'functions': functions, 'events': {k: dict(v) for k, v in self.events.items()}}
+
+    def to_json(self):
+        """Return the profile as one line of JSON."""
+        return json.dumps(self.as_dict(), sort_keys=True)
+
+    def dump_stats(self, path):
+        """Write the profile in the format of cProfile's dump_stats, which
+        pstats.Stats(path) reads."""
+        stats = {label: (c, n, tt, ct, dict(callers))
+                 for label, (_, n, c, tt, ct, callers) in self.functions.items()}
+        with open(path, 'wb') as f: marshal.dump(stats, f)
+
+
+class profile:
+    """A context manager that makes a new Profile active, and returns it.
+    Profiles nest: an inner profile's records are added to the outer one."""
+    def __enter__(self):
+        global _profile
+        self.outer, self.profile = _profile, Profile()
+        _profile = self.profile
+        return self.profile
+
+    def __exit__(self, *exc):
+        global _profile
+        _profile = self.outer
+        if self.outer is not None: self.outer.merge(self.profile)
+
+
+def instrumented(function):
+    """Decorate a function, or generator function, so that an active
+    Profile records its calls and time."""
+    code = function.__code__
+    label = (code.co_filename, code.co_firstlineno, function.__name__)
+    name = function.__qualname__
+    if isgeneratorfunction(function):
+        @wraps(function)
+        def generator(*args, **kwargs):
+            iterator = function(*args, **kwargs)
+            if _profile is None:
+                yield from iterator
+                return
+            calls = 1
+            while True:
+                profile = _profile
+                try: 
+                    if profile is None: value = next(iterator)
+                    else: value = profile.call(label, name, next, (iterator,), {}, calls)
+                except StopIteration: return
+                calls = 0
+                yield value
+        return generator
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        if _profile is None: return function(*args, **kwargs)
+        return _profile.call(label, name, function, args, kwargs)
+    return wrapper
+
+def count(event, n=1):
+    """Count n events in the active Profile, if any."""
+    if _profile is not None: _profile.count(event, n)
+
+def maximum(event, value):
+    """Record the largest value of event in the active Profile, if any."""
+    if _profile is not None: _profile.maximum(event, value)
+
+
+def _report(destination):
+    """Write the process-wide profile to OYSTER_PROFILE's destination."""
+    if destination.lower() in ('1', 'true', 'yes'): print(_profile.to_json(), file=sys.stderr)
+    elif destination.endswith('.prof'): _profile.dump_stats(destination)
+    else:
+        with open(destination, 'a') as f: f.write(_profile.to_json() + '\n')
+
+if os.environ.get('OYSTER_PROFILE'):
+    _profile = Profile()
+    atexit.register(_report, os.environ['OYSTER_PROFILE'])
@@ -0,0 +1,65 @@
+"""A precomputed reachability index for node selectors on DAGs."""
+
+import networkx as nx
+from oyster.utils.set_utils import _set
+
+
+class ReachabilityIndex:
+    """Parent, child, ancestor, descendant and Markov blanket sets of
+    every node in a DAG, stored as integer bitsets over node ids.
+
+    Node ids follow a topological order, so the ancestor and descendant
+    closures are computed in one pass each. Afterwards the selectors of
+    any node set are a bitwise OR of precomputed rows."""
+
+    def __init__(self, DAG):
+        self.nodes = list(nx.topological_sort(DAG))
+        self.ids = {node: i for i, node in enumerate(self.nodes)}
+        n = len(self.nodes)
+        self.pa, self.ch = [0] * n, [0] * n
+        self.an, self.de = [0] * n, [0] * n
+        for i, node in enumerate(self.nodes):
+            for p in DAG.pred[node]:
+                j = self.ids[p]
+                self.pa[i] |= 1 << j
+                self.ch[j] |= 1 << i
+                self.an[i] |= self.an[j] | 1 << j
+        for i in reversed(range(n)):
+            for j in self.ids_of(self.ch[i]):
+                self.de[i] |= self.de[j] | 1 << j
+        self.mb = [0] * n
+        for i in range(n):
+            spouses = 0
+            for j in self.ids_of(self.ch[i]): spouses |= self.pa[j]
+            self.mb[i] = (self.pa[i] | self.ch[i] | spouses) & ~(1 << i)
+
+    def bits(self, nodes):
+        """Return the bitset of nodes."""
+        bits = 0
+        for node in _set(nodes): bits |= 1 << self.ids[node]
+        return bits
+
+    def ids_of(self, bits):
+        """Return the list of node ids set in bits."""
+        digits = bin(bits)[:1:-1] # Least significant first
+        ids, i = [], digits.find('1')
+        while i != -1:
+            ids.append(i)
+            i = digits.find('1', i + 1)
+        return ids
+
+    def names(self, bits):
+        """Return the set of nodes in bits."""
+        return {self.nodes[i] for i in self.ids_of(bits)}
+
+    def union(self, rows, nodes):
+        """Return the union of the rows of nodes, as a bitset."""
+        bits = 0
+        for node in _set(nodes): bits |= rows[self.ids[node]]
+        return bits
+
+    def ancestors(self, nodes): return self.names(self.union(self.an, nodes))
+    def descendants(self, nodes): return self.names(self.union(self.de, nodes))
+    def parents(self, nodes): return self.names(self.union(self.pa, nodes))
+    def children(self, nodes): return self.names(self.union(self.ch, nodes))
+    def markov_blanket(self, nodes): return self.names(self.union(self.mb, nodes))
@@ -0,0 +1,85 @@
+"""Limits on the time and size of searches for sets of nodes."""
+
+import threading
+import time
+from oyster.utils.profiling import count
+
+
+class Budget:
+    """Limits for one or more searches: the number of results, the size of
+    the sets in them, the wall-clock time in seconds, and the number of
+    evaluations (candidate checks). Any limit left as None is unbounded.
+
+    The clock starts at the first evaluation, and searches sharing a Budget
+    share its limits, including the count of results listed. A search stops
+    when the budget runs out or cancel() is called, from any thread, and
+    sets truncated."""
+    def __init__(self, max_results=None, max_set_size=None, timeout=None,
+                 max_evaluations=None):
+        self.max_results, self.max_set_size = max_results, max_set_size
+        self.timeout, self.max_evaluations = timeout, max_evaluations
+        self.evaluations, self.results = 0, 0
+        self.truncated = False
+        self._deadline = None
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        """Stop the searches using this budget at their next evaluation."""
+        self._cancelled.set()
+
+    def start(self):
+        """Start the clock, if it has not started."""
+        if self.timeout is not None and self._deadline is None:
+            self._deadline = time.monotonic() + self.timeout
+
+    def exhausted(self):
+        """Return if the budget has run out, marking it truncated if so."""
+        self.start()
+        if (self._cancelled.is_set() or
+            self._deadline is not None and time.monotonic() > self._deadline or
+            self.max_evaluations is not None and self.evaluations >= self.max_evaluations):
+            self.truncated = True
+        return self.truncated
+
+    def spend(self):
+        """Count one evaluation. Return False if the budget has run out."""
+        if self.exhausted(): return False
+        self.evaluations += 1
+        count('subsets examined')
+        return True
+
+    def fits(self, nodes):
+        """Return if a set of nodes is within max_set_size."""
+        return self.max_set_size is None or len(nodes) <= self.max_set_size
+
+
+class SearchResult(list):
+    """The list of results of a search, with truncated set if the search
+    stopped before listing every result."""
+    def __init__(self, results=(), truncated=False):
+        super().__init__(results)
+        self.truncated = truncated
+
+def limited(results, budget):
+    """Generate results until the budget runs out or max_results are listed
+    by the searches sharing it. A result found as the budget runs out is
+    still listed."""
+    results = iter(results)
+    while not budget.exhausted():
+        try: result = next(results)
+        except StopIteration: return
+        if budget.max_results is not None and budget.results >= budget.max_results:
+            budget.truncated = True # There was another result
+            return
+        budget.results += 1
+        yield result
+
+def search(results, budget=None, lazy=False):
+    """Return the results of a search as a SearchResult within budget, or
+    with lazy=True as a generator whose budget is truncated if it stops
+    early."""
+    budget = Budget() if budget is None else budget
+    results = limited(results, budget)
+    if lazy: return results
+    results = list(results)
+    return SearchResult(results, budget.truncated)
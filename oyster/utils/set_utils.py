@@ -1,7 +1,6 @@
 """Utility functions for working with sets."""
 
 from itertools import chain, combinations, groupby
-from functools import reduce
 
 def powerset(iterable):
     """Iterator of the set of all sets, (including {}) of elements in iterable."""
@@ -15,14 +14,98 @@ def all_equal(iterable):
 
 def same_sets(set_lists):
     """Return if the provided lists of sets contain the same sets."""
-    set_sets = [{frozenset(S) for S in sl} for sl in set_lists]
-    return all_equal(set_sets)
+    index = SetIndex()
+    return all_equal({index.mask(S) for S in sl} for sl in set_lists)
 
 def minimal_sets(sets):
     "Return a list of the minimal sets in a list of sets."
-    def append_if_no_subsets(xs, y):
-        return xs + [y] if not any(x < y for x in xs) else xs
-    return reduce(append_if_no_subsets, sorted(sets, key=len), [])
+    return list(Antichain(sorted(sets, key=len)))
+
+
+### Set Families ###
+class SetIndex:
+    """Assigns bit positions to elements so sets can be stored as 
+    integer bitmasks, where subset tests are a single AND."""
+    def __init__(self):
+        self.bits = {}
+        
+    def mask(self, S):
+        """Return the bitmask of the elements of S."""
+        mask = 0
+        for element in _set(S):
+            bit = self.bits.get(element)
+            if bit is None: bit = self.bits[element] = 1 << len(self.bits)
+            mask |= bit
+        return mask
+
+class Antichain:
+    """A family of sets none of which contains another.
+    
+    Keeps the minimal sets added (or the maximal ones, if minimal=False),
+    so sets can be streamed in as they are found in any order. Sets are 
+    stored as bitmasks indexed by their lowest bit and by each of their 
+    bits, so a dominance check only compares the stored sets that could 
+    be subsets (those whose lowest bit is in the set) or supersets (those
+    with the set's least shared bit)."""
+    def __init__(self, sets=(), minimal=True, index=None):
+        self.minimal = minimal
+        self.index = SetIndex() if index is None else index
+        self._sets = {}    # mask -> set
+        self._lowest = {}  # lowest bit (0 for the empty set) -> masks
+        self._members = {} # bit -> masks with the bit
+        for S in sets: self.add(S)
+    
+    @staticmethod
+    def _bits(mask):
+        while mask:
+            bit = mask & -mask
+            yield bit
+            mask ^= bit
+    
+    def _smaller(self, mask):
+        """Masks of stored sets that are subsets of mask."""
+        candidates = chain(self._lowest.get(0, ()), 
+                           *(self._lowest.get(bit, ()) for bit in self._bits(mask)))
+        return [m for m in candidates if m & mask == m]
+    
+    def _larger(self, mask):
+        """Masks of stored sets that are supersets of mask."""
+        if not mask: return list(self._sets)
+        candidates = min((self._members.get(bit, ()) for bit in self._bits(mask)), key=len)
+        return [m for m in candidates if m & mask == mask]
+    
+    def _remove(self, mask):
+        del self._sets[mask]
+        self._lowest[mask & -mask].discard(mask)
+        for bit in self._bits(mask): self._members[bit].discard(mask)
+    
+    def dominated(self, S):
+        """Return if S is a superset (subset, if maximal) of a stored set."""
+        mask = self.index.mask(S)
+        dominating = self._smaller if self.minimal else self._larger
+        return bool(dominating(mask))
+    
+    def add(self, S):
+        """Add S unless it is dominated, dropping the sets it dominates.
+        Return if S was added."""
+        mask = self.index.mask(S)
+        dominating, dominated = ((self._smaller, self._larger) if self.minimal 
+                                 else (self._larger, self._smaller))
+        if dominating(mask): return False
+        for m in dominated(mask): self._remove(m)
+        self._sets[mask] = S
+        self._lowest.setdefault(mask & -mask, set()).add(mask)
+        for bit in self._bits(mask): self._members.setdefault(bit, set()).add(mask)
+        return True
+    
+    def __iter__(self):
+        return (S for _, S in sorted(self._sets.items(), key=lambda item: bin(item[0]).count('1')))
+    
+    def __len__(self):
+        return len(self._sets)
+    
+    def __contains__(self, S):
+        return self.index.mask(S) in self._sets
 
 def _set(iterable):
     """Return a set from an iterable, treating multicharacter strings as one element."""
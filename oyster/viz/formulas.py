@@ -1,9 +1,8 @@
 """Representing adjustment formulas in Latex."""
 
-from oyster import *
-from oyster.utils.graph_utils import *
+from oyster.adjust import meets_backdoor_criterion, meets_frontdoor_criterion
+from oyster.utils.graph_utils import Pa, do_X
 from oyster.utils.set_utils import _set
-from oyster.utils.set_utils import *
 
 def joint_factorization(DAG, do=[], hidden=[]):
     """Return an expression for the joint probability distribution
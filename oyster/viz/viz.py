@@ -1,16 +1,23 @@
 """Visualization functions for graphical causal models."""
 
 import networkx as nx
-from oyster.structures import paths
-from oyster.utils.graph_utils import ancestral_graph, moral_graph, reversible_edges
+from oyster.structures import paths, Path
+from oyster.utils.graph_utils import ancestral_graph, moral_graph
 from oyster.utils.set_utils import _set
-from oyster.equivalence import dag_to_cpdag, equivalence_class_size
+from oyster.equivalence import dag_to_cpdag, equivalence_class_size, cpdag_size
 import oyster.example.graphs as ex
 from itertools import chain
 import matplotlib.pyplot as plt
 
-def print_path(path, start):
-    """Pretty-prints a path from an nx.DiGraph"""
+def print_path(path, start=None):
+    """Pretty-prints a Path, or a path from an nx.DiGraph starting at start."""
+    if isinstance(path, Path):
+        ppstr = str(path.nodes[0])
+        for i, node in enumerate(path.nodes[1:]):
+            if path.bidirected >> i & 1: ppstr += f' <-> {node}'
+            else: ppstr += f' -> {node}' if path.forward >> i & 1 else f' <- {node}'
+        print(ppstr)
+        return
     ppstr = start
     head = start
     for (s, t) in path.edges():
@@ -22,9 +29,10 @@ def print_path(path, start):
             head = s
     print(ppstr)
 
-def print_paths(DAG, start, finish, directed=False):
-    for path in paths(DAG, start, finish, directed=directed): 
-        print_path(path, start=start) 
+def print_paths(DAG, start, finish, directed=False, **kwargs):
+    """Pretty-prints the paths from start to finish (see structures.paths)."""
+    for path in paths(DAG, start, finish, directed=directed, **kwargs): 
+        print_path(path)
 
 def draw(G, pos=None, title=None, ax=None, 
          _show_axis_lines=False):
@@ -65,7 +73,7 @@ def draw_cpdag(DAG, pos=None):
     f, axs = plt.subplots(1,2, constrained_layout=True)
     draw(DAG, title='DAG', pos=pos, ax=axs[0])
     draw(cpdag, title='CPDAG', pos=pos, ax=axs[1])
-    print(f'equivalent dags: {2 ** (len(reversible_edges(cpdag)) // 2)}')
+    print(f'equivalent dags: {cpdag_size(cpdag)}')
 
 def gv_draw(G, pos=None, filename='oyster/viz/images/graph.png', 
             font_color='black', 
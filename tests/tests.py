@@ -2,17 +2,48 @@
 
 from context import oyster
 
+import json
+import os
+import pstats
+import subprocess
+import sys
+import tempfile
 import unittest
+from itertools import chain, combinations, islice
+import networkx as nx
 
-from oyster.adjust import (d_separated, d_separator_search, 
+from oyster.adjust import (d_separated, d_connected_nodes, d_separator_search, 
                            backdoor_criterion_search, minimal_adjustment_sets, specific_adjustment_sets, 
-                           meets_frontdoor_criterion, frontdoor_criterion_search)
-from oyster.identify import is_identifiable, is_identifiable_single_x
+                           backdoor_adjustment_sets, meets_backdoor_criterion,
+                           minimal_d_separators, separators,
+                           meets_frontdoor_criterion, frontdoor_criterion_search,
+                           frontdoor_adjustment_sets, meets_adjustment_criterion,
+                           adjustment_set, optimal_adjustment_set, is_amenable, adjusters)
+from oyster.oyster import iter_implied_independencies
+from oyster.identify import is_identifiable, is_identifiable_single_x, Identifier, Hedge
 from oyster.structures import (root_set, is_tree, is_forest, is_c_component,
-                               c_components,)
-from oyster.equivalence import equivalence_class_size
-from oyster.utils.set_utils import minimal_sets, _set, same_sets
-from oyster.utils.graph_utils import MB, NA_pairs, v_structures
+                               c_components, paths, is_confounded,
+                               has_confounded_path, confounded_nodes, Path)
+from oyster.equivalence import (equivalence_class_size, dag_to_cpdag, amo_count, 
+                                equivalent_dags, sample_dag, consistent_extension)
+from oyster.batch import analyze, pair_queries, Query
+from oyster.instruments import (instrumental_variable_search, ancestral_instrument_search,
+                                is_ancestral_instrument, nearest_separator,
+                                is_instrumental_variable)
+from oyster.utils.set_utils import minimal_sets, _set, same_sets, Antichain, powerset
+from oyster.utils.search import Budget, SearchResult
+from oyster.utils.profiling import profile
+from oyster.utils.graph_utils import (MB, NA_pairs, v_structures, 
+                                      ancestral_graph, moral_graph, An, De, Pa, Ch,
+                                      hidden_nodes, observable_nodes, latent_projection, bidirected_edges,
+                                      backdoor_graph, do_X)
+from oyster.surgery import surgery
+from oyster.io import (from_dagitty, to_dagitty, from_dot, to_dot, read_csv, write_csv,
+                       read_binary, write_binary)
+from oyster.diagram import CausalDiagram, FrozenCausalDiagram
+from benchmarks.generators import (GENERATORS, confounded_dag, erdos_renyi_dag, 
+                                   scale_free_dag, layered_dag)
+from benchmarks.suite import run
 from oyster.example.graphs import mit, bow, primer, sp08, chickering
 
 class test_causal_structures(unittest.TestCase):
@@ -27,11 +58,152 @@ class test_causal_structures(unittest.TestCase):
                           'Z2': {'W', 'Y', 'Z1', 'Z3'},
                           'Z3': {'W', 'X', 'Y', 'Z1', 'Z2'}})
     
+    def test_reachability_index(self):
+        G = CausalDiagram(bow['fig4_7'])
+        expected = {f: {v: f(G, v) for v in G} for f in (An, De, Pa, Ch, MB)}
+        G.build_index()
+        for f, results in expected.items():
+            self.assertEqual({v: f(G, v) for v in G}, results)
+        self.assertEqual(De(G, {'C', 'A'}), {'B', 'E', 'X', 'Y'})
+        
+        # Mutating the diagram drops the index
+        G.add_edge('Y', 'Z')
+        self.assertEqual(De(G, 'X'), {'Y', 'Z'})
+        self.assertEqual(An(G, 'Z'), An(bow['fig4_7'], 'Y') | {'Y'})
+
+    def test_surgery(self):
+        G = bow['fig4_7']
+        S = surgery(G).do(['X', 'E']).backdoor('A')
+        self.assertEqual(set(S.edges), set(backdoor_graph(do_X(G, ['X', 'E']), 'A').edges))
+        self.assertEqual(set((surgery(G).do(['X', 'E']) | surgery(G).backdoor('A')).edges), 
+                         set(S.edges))
+        self.assertEqual(set(surgery(G).without([('X', 'Y')]).edges), set(G.edges) - {('X', 'Y')})
+        self.assertEqual(De(S, 'C'), De(backdoor_graph(do_X(G, ['X', 'E']), 'A'), 'C'))
+        for Z in ({'E'}, {'A', 'B'}, set()):
+            self.assertEqual(d_separated(S, 'C', 'Y', Z), 
+                             d_separated(backdoor_graph(do_X(G, ['X', 'E']), 'A'), 'C', 'Y', Z))
+        
+        confounded = nx.DiGraph([('X', 'Y'), ('U', 'X'), ('U', 'Y')])
+        confounded.nodes['U']['hidden'] = True
+        self.assertFalse(is_identifiable(confounded, 'X', 'Y'))
+        self.assertTrue(is_identifiable(surgery(confounded).do('X'), 'X', 'Y'))
+
+    def test_diagram_cache(self):
+        G = CausalDiagram([('Z', 'X'), ('X', 'Y'), ('Z', 'Y'), ('X', 'W')])
+        self.assertFalse(d_separated(G, 'Z', 'Y', 'X'))
+        self.assertFalse(d_separated(G, 'Z', 'Y', 'X'))
+        self.assertEqual(G.cache_info().hits, 1)
+        Gx = backdoor_graph(G, 'X')
+        self.assertIs(backdoor_graph(G, 'X'), Gx)
+        self.assertTrue(d_separated(Gx, 'Z', 'W', set()))
+        
+        # Changing the diagram clears its cache and those of its views
+        version = G.version
+        G.remove_edge('Z', 'Y')
+        self.assertGreater(G.version, version)
+        self.assertTrue(d_separated(G, 'Z', 'Y', 'X'))
+        G.add_edges_from([('Z', 'W'), ('W', 'Y')])
+        self.assertFalse(d_separated(Gx, 'Z', 'Y', set()))
+        self.assertEqual(De(G, 'X'), {'W', 'Y'})
+        
+        info = G.cache_info()
+        self.assertTrue(0 < info.hit_rate < 1)
+        self.assertLessEqual(info.currsize, info.maxsize)
+        G = CausalDiagram(combinations('ABCDEF', 2), cache_size=4)
+        for v in G: An(G, v)
+        self.assertEqual(G.cache_info().currsize, 4)
+
+    def test_frozen_diagram(self):
+        G = CausalDiagram(bow['fig4_7'])
+        F = G.freeze()
+        self.assertIsInstance(F, FrozenCausalDiagram)
+        self.assertEqual(set(F.edges), set(G.edges))
+        for v in G:
+            self.assertEqual(An(F, v), An(G, v))
+            self.assertEqual(De(F, v), De(G, v))
+        for Z in ({'E'}, {'A', 'B'}, set()):
+            self.assertEqual(d_separated(F, 'C', 'Y', Z), d_separated(G, 'C', 'Y', Z))
+            self.assertEqual(d_separated(do_X(F, 'X'), 'C', 'Y', Z), 
+                             d_separated(do_X(G, 'X'), 'C', 'Y', Z))
+            self.assertEqual(meets_adjustment_criterion(F, 'X', 'Y', Z),
+                             meets_adjustment_criterion(G, 'X', 'Y', Z))
+        self.assertTrue(same_sets([backdoor_criterion_search(F, 'X', 'Y'),
+                                   backdoor_criterion_search(G, 'X', 'Y')]))
+        
+        confounded = CausalDiagram([('X', 'Y'), ('U', 'X'), ('U', 'Y'), ('Y', 'W')])
+        confounded.nodes['U']['hidden'] = True
+        self.assertEqual({frozenset(c) for c in c_components(confounded.freeze())},
+                         {frozenset('XY'), frozenset('W')})
+    
+    def test_paths(self):
+        G = primer['fig1_8']
+        self.assertEqual({p.nodes for p in paths(G, 'X', 'T', directed=True)},
+                         {('X', 'W', 'Y', 'T'), ('X', 'W', 'Y', 'Z', 'T'), ('X', 'W', 'Z', 'T'),
+                          ('X', 'Y', 'T'), ('X', 'Y', 'Z', 'T')})
+        self.assertEqual(len(list(paths(G, 'X', 'T'))), 7)
+        self.assertEqual(list(paths(G, 'X', 'T', max_length=2)), [Path(('X', 'Y', 'T'), 0b11)])
+        self.assertEqual(Path(('X', 'Y', 'W'), 0b01).edges(), [('X', 'Y'), ('W', 'Y')])
+        self.assertEqual(len(list(paths(G, 'X', 'T', max_paths=3))), 3)
+        # Only the paths left open by conditioning on Y
+        self.assertEqual({p.nodes for p in paths(G, 'X', 'T', Z={'Y'})},
+                         {('X', 'W', 'Z', 'T'), ('X', 'Y', 'W', 'Z', 'T')})
+        for Z in ({'W'}, {'Z'}, {'W', 'Y', 'Z'}):
+            self.assertEqual(not any(paths(G, 'X', 'T', Z=Z)), d_separated(G, 'X', 'T', Z))
+        self.assertEqual([p.nodes for p in paths(nx.Graph([('a', 'b'), ('b', 'c')]), 'a', 'c')],
+                         [('a', 'b', 'c')])
+        self.assertEqual(list(paths(nx.Graph([('a', 'b'), ('b', 'c')]), 'a', 'c', Z={'b'})), [])
+        
+        # Bidirected edges of an ADMG, with open paths as in m-separation
+        admg = latent_projection(sp08['fig1']['h'])
+        self.assertIn(Path(('X', 'Z', 'Y'), 0b11, 0b11), paths(admg, 'X', 'Y'))
+        self.assertEqual(Path(('X', 'Z', 'Y'), 0b11, 0b01).edges(), [('Z', 'Y')])
+        for Z in powerset(set(admg) - {'X', 'Y'}):
+            self.assertEqual(not any(paths(admg, 'X', 'Y', Z=Z)), d_separated(admg, 'X', 'Y', Z))
+    
     def test_v_structures(self):
         vs = v_structures(primer['fig3_8'])
         self.assertTrue(same_sets((vs['Z'], [{'B', 'C'}])))
         self.assertTrue(same_sets((vs['X'], [{'A', 'Z'}])))
         self.assertTrue(same_sets((vs['Y'], [{'W', 'Z'}, {'D', 'W'}, {'D', 'Z'}])))
+        
+    def test_latent_projection(self):
+        self.assertEqual(hidden_nodes(sp08['fig1']['h']), {'U1', 'U2', 'U3', 'U4'})
+        self.assertEqual(hidden_nodes(primer['fig2_5']), set()) # 'U' is observed here
+        
+        admg = latent_projection(sp08['fig1']['d'])
+        self.assertEqual(set(admg.nodes), {'X', 'Y', 'Z'})
+        self.assertEqual(set(admg.edges), {('X', 'Y'), ('Z', 'Y')})
+        self.assertEqual({frozenset(e) for e in bidirected_edges(admg)},
+                         {frozenset({'X', 'Z'}), frozenset({'Y', 'Z'})})
+        
+        for G in chain(sp08['fig1'].values(), sp08['fig2'].values()):
+            admg = latent_projection(G)
+            self.assertEqual({frozenset(c) for c in c_components(admg)},
+                             {frozenset(c) for c in c_components(G)})
+            self.assertEqual(is_c_component(admg), is_c_component(G))
+            self.assertEqual(is_identifiable(admg, 'X', 'Y'), is_identifiable(G, 'X', 'Y'))
+            self.assertEqual(is_identifiable_single_x(admg, 'X', 'Y'), 
+                             is_identifiable_single_x(G, 'X', 'Y'))
+        self.assertTrue(is_identifiable(latent_projection(sp08['fig3']['a']), 'X', {'Y1', 'Y2'}))
+        self.assertFalse(is_identifiable(latent_projection(sp08['fig3']['b']), 'X', {'Y1', 'Y2'}))
+
+
+class test_set_utils(unittest.TestCase):
+    
+    def test_antichain(self):
+        sets = [{'A', 'B'}, {'A', 'B', 'C'}, {'C'}, {'B'}, {'B', 'C'}, {'A', 'B'}, {'D'}]
+        self.assertTrue(same_sets((Antichain(sets), [{'B'}, {'C'}, {'D'}])))
+        self.assertTrue(same_sets((Antichain(sets, minimal=False), [{'A', 'B', 'C'}, {'D'}])))
+        self.assertTrue(same_sets((minimal_sets(sets), [{'B'}, {'C'}, {'D'}])))
+        
+        minimal = Antichain()
+        self.assertTrue(minimal.add({'A', 'B'}))
+        self.assertFalse(minimal.add({'A', 'B', 'C'}))
+        self.assertTrue(minimal.dominated({'A', 'B', 'D'}))
+        self.assertTrue(minimal.add({'A'}))
+        self.assertEqual(list(minimal), [{'A'}])
+        self.assertIn({'A'}, minimal)
+        self.assertNotIn({'A', 'B'}, minimal)
 
 
 class test_adjust(unittest.TestCase):
@@ -62,6 +234,22 @@ class test_adjust(unittest.TestCase):
                          {frozenset({'W', 'Z1'}): [frozenset({'X'})],
                           frozenset({'W', 'Z3'}): [frozenset({'X'})]})
         
+    def test_minimal_d_separators(self):
+        G = primer['fig2_9']
+        self.assertEqual(
+            {frozenset((X, Y)): {frozenset(S) for S in seps}
+             for X, Y, seps in iter_implied_independencies(G)},
+            {frozenset((X, Y)): {frozenset(S) for S in minimal_sets(d_separator_search(G, X, Y))}
+             for X, Y in NA_pairs(G)})
+        self.assertEqual(len(minimal_d_separators(G, 'X', 'Y', max_results=1)), 1)
+        
+        # 20 disjoint paths X -> Ai -> Bi -> Y give 2^20 minimal separators
+        G = nx.DiGraph([e for i in range(20) for e in 
+                        (('X', f'A{i}'), (f'A{i}', f'B{i}'), (f'B{i}', 'Y'))])
+        seps = minimal_d_separators(G, 'X', 'Y', max_results=100)
+        self.assertEqual(len(seps), 100)
+        self.assertTrue(all(d_separated(G, 'X', 'Y', S) and len(S) == 20 for S in seps))
+        
     def test_d_separated(self):
         G = primer['fig2_9']
         # Primer study question 2.4.1 c)
@@ -84,6 +272,29 @@ class test_adjust(unittest.TestCase):
         self.assertFalse(d_separated(mit, 'D', 'E', ['A', 'B']))
         self.assertFalse(d_separated(mit, ['E', 'G'], 'D', 'C'))
         
+    def test_d_separated_matches_moral_graph(self):
+        def moral_d_separated(DAG, X, Y, Z):
+            m = moral_graph(ancestral_graph(DAG, {X, Y} | Z))
+            return not nx.has_path(m.subgraph(m.nodes - Z), X, Y)
+        
+        # Only a moral graph cached by a CausalDiagram is frozen
+        self.assertTrue(nx.is_frozen(moral_graph(CausalDiagram(mit.edges))))
+        moral = moral_graph(nx.DiGraph(mit.edges))
+        moral.remove_node('C')
+        self.assertNotIn('C', moral)
+        
+        for G in [mit, primer['fig2_9'], primer['fig3_8'], bow['fig4_7']]:
+            for X, Y in combinations(G.nodes, 2):
+                others = G.nodes - {X, Y}
+                for Z in [set()] + [{z} for z in others] + [set(others)]:
+                    self.assertEqual(d_separated(G, X, Y, Z), 
+                                     moral_d_separated(G, X, Y, Z))
+    
+    def test_d_connected_nodes(self):
+        self.assertEqual(d_connected_nodes(mit, 'A', []), {'C', 'D', 'E', 'F', 'G'})
+        self.assertEqual(d_connected_nodes(mit, 'A', ['C']), {'B'})
+        self.assertEqual(d_connected_nodes(mit, 'A', ['G']), {'B', 'C', 'D', 'E', 'F'})
+        
     def test_backdoor_criterion_search(self):
         self.assertTrue(same_sets((
             backdoor_criterion_search(primer['fig3_7'], 'X', 'Y'), 
@@ -123,6 +334,59 @@ class test_adjust(unittest.TestCase):
             minimal_adjustment_sets(bow['fig4_7'], 'X', 'Y'),
             [{'C', 'E', 'F', 'G'}, {'A', 'B', 'E', 'F', 'G'}])))
 
+    def test_backdoor_adjustment_sets(self):
+        # 30 back-door paths X <- Ai <- Bi -> Y: 2^30 minimal sets over 60 candidates
+        G = nx.DiGraph([('X', 'Y')] + 
+                       [e for i in range(30) for e in 
+                        ((f'A{i}', 'X'), (f'B{i}', f'A{i}'), (f'B{i}', 'Y'))])
+        first = list(islice(backdoor_adjustment_sets(G, 'X', 'Y'), 5))
+        self.assertEqual(len(first), 5)
+        for Z in first:
+            self.assertEqual(len(Z), 30)
+            self.assertTrue(meets_backdoor_criterion(G, 'X', 'Y', Z))
+        
+        self.assertTrue(same_sets((
+            backdoor_adjustment_sets(primer['fig3_8'], 'X', 'Y', exclude='Z'), [])))
+        self.assertTrue(same_sets((
+            backdoor_adjustment_sets(primer['fig3_8'], 'X', 'Y', include='A', exclude='B'),
+            [{'A', 'Z'}])))
+
+    def test_search_budget(self):
+        # 2^30 back-door adjustment sets
+        G = nx.DiGraph([('X', 'Y')] + 
+                       [e for i in range(30) for e in 
+                        ((f'A{i}', 'X'), (f'B{i}', f'A{i}'), (f'B{i}', 'Y'))])
+        results = backdoor_criterion_search(G, 'X', 'Y', Budget(max_results=10))
+        self.assertIsInstance(results, SearchResult)
+        self.assertEqual(len(results), 10)
+        self.assertTrue(results.truncated)
+        
+        budget = Budget(max_evaluations=100)
+        results = backdoor_criterion_search(G, 'X', 'Y', budget)
+        self.assertTrue(results.truncated)
+        self.assertEqual(budget.evaluations, 100)
+        
+        results = backdoor_criterion_search(G, 'X', 'Y', Budget(timeout=0.05))
+        self.assertTrue(results.truncated)
+        
+        budget = Budget(max_results=5, max_set_size=30)
+        for Z in backdoor_criterion_search(G, 'X', 'Y', budget, lazy=True):
+            self.assertLessEqual(len(Z), 30)
+        self.assertTrue(budget.truncated)
+        
+        budget = Budget(max_results=15) # Shared by both searches
+        self.assertEqual(len(backdoor_criterion_search(G, 'X', 'Y', budget)), 15)
+        self.assertEqual(backdoor_criterion_search(G, 'X', 'Y', budget), [])
+        self.assertEqual(budget.results, 15)
+        
+        budget = Budget()
+        budget.cancel()
+        self.assertEqual(frontdoor_criterion_search(G, 'X', 'Y', budget), [])
+        self.assertTrue(budget.truncated)
+        
+        results = d_separator_search(primer['fig3_8'], 'X', 'Y')
+        self.assertFalse(results.truncated)
+
     def test_specfic_adjustment_sets(self):
         G = primer['fig3_8']
         # Primer 3.5.1 a)
@@ -135,8 +399,89 @@ class test_adjust(unittest.TestCase):
             [{'A', 'B', 'C', 'Z'}, {'B', 'C', 'D', 'Z'},
              {'A', 'B', 'D', 'Z'}, {'A', 'C', 'D', 'Z'}])))
 
+    def test_frontdoor_adjustment_sets(self):
+        # 20 directed paths X -> Ai -> Bi -> Y, confounded by U: 2^20 minimal sets
+        G = nx.DiGraph([('U', 'X'), ('U', 'Y')] + 
+                       [e for i in range(20) for e in 
+                        (('X', f'A{i}'), (f'A{i}', f'B{i}'), (f'B{i}', 'Y'))])
+        first = list(islice(frontdoor_adjustment_sets(G, 'X', 'Y'), 5))
+        self.assertEqual(len(first), 5)
+        for Z in first:
+            self.assertEqual(len(Z), 20)
+            self.assertTrue(meets_frontdoor_criterion(G, 'X', 'Y', Z))
+        
+        G = nx.DiGraph([('U', 'X'), ('U', 'Y'), ('X', 'A'), ('A', 'B'), ('B', 'Y'), ('U', 'B')])
+        self.assertTrue(same_sets((frontdoor_adjustment_sets(G, 'X', 'Y'), [{'A'}])))
+        self.assertTrue(same_sets((
+            frontdoor_adjustment_sets(G, 'X', 'Y', exclude='A'), [])))
+        self.assertTrue(same_sets((
+            frontdoor_criterion_search(primer['fig3_8'], 'X', 'Y'), 
+            [set(S) for S in powerset(primer['fig3_8'].nodes - {'X', 'Y'}) 
+             if meets_frontdoor_criterion(primer['fig3_8'], 'X', 'Y', set(S))])))
+
+    def test_adjustment_set(self):
+        G = nx.DiGraph([('A', 'X'), ('A', 'Y'), ('X', 'M'), ('M', 'Y'), 
+                        ('B', 'M'), ('C', 'Y'), ('X', 'F'), ('M', 'D')])
+        # F descends from X but not from a proper causal path
+        self.assertTrue(meets_adjustment_criterion(G, 'X', 'Y', {'A', 'F'}))
+        self.assertFalse(meets_backdoor_criterion(G, 'X', 'Y', {'A', 'F'}))
+        self.assertFalse(meets_adjustment_criterion(G, 'X', 'Y', {'A', 'D'}))
+        self.assertEqual(adjustment_set(G, 'X', 'Y'), {'A', 'B', 'C'})
+        self.assertEqual(adjustment_set(G, 'X', 'Y', minimal=True), {'A'})
+        self.assertEqual(adjustment_set(G, 'X', 'Y', include='C', minimal=True), {'A', 'C'})
+        self.assertIsNone(adjustment_set(G, 'X', 'Y', exclude='A'))
+        self.assertEqual(optimal_adjustment_set(G, 'X', 'Y'), {'A', 'B', 'C'})
+        self.assertEqual(optimal_adjustment_set(G, 'X', 'Y', minimal=True), {'A'})
+        self.assertIsNone(optimal_adjustment_set(G, 'X', 'Y', exclude='B'))
+        
+        G = primer['fig3_8']
+        for Z in backdoor_criterion_search(G, 'X', 'Y'):
+            self.assertTrue(meets_adjustment_criterion(G, 'X', 'Y', Z))
+        self.assertTrue(meets_adjustment_criterion(G, 'X', 'Y', optimal_adjustment_set(G, 'X', 'Y')))
+
+    def test_cpdag_adjustment(self):
+        # B - A is reversible, the edges into X and Y are compelled
+        cpdag = dag_to_cpdag(nx.DiGraph([('C', 'X'), ('D', 'X'), ('X', 'Y'), 
+                                         ('A', 'X'), ('A', 'Y'), ('B', 'A')]))
+        self.assertTrue(cpdag.has_edge('A', 'B') and cpdag.has_edge('B', 'A'))
+        self.assertTrue(d_separated(cpdag, 'B', 'X', 'A'))
+        self.assertFalse(d_separated(cpdag, 'B', 'C', 'X'))
+        self.assertTrue(is_amenable(cpdag, 'X', 'Y'))
+        self.assertTrue(meets_adjustment_criterion(cpdag, 'X', 'Y', {'A', 'B'}))
+        self.assertEqual(adjustment_set(cpdag, 'X', 'Y', minimal=True), {'A'})
+        self.assertEqual(optimal_adjustment_set(cpdag, 'X', 'Y'), {'A'})
+        self.assertIsNone(adjustment_set(cpdag, 'X', 'Y', exclude='A'))
+        self.assertTrue(cpdag.graph['cpdag'])
+        extension = consistent_extension(cpdag)
+        self.assertFalse(extension.graph['cpdag'])
+        self.assertTrue(nx.is_directed_acyclic_graph(extension))
+        self.assertIn('extension', cpdag.graph) # Kept for later queries
+        self.assertEqual(set(consistent_extension(cpdag).edges), set(extension.edges))
+        marked = nx.DiGraph(cpdag.edges, cpdag=True)
+        self.assertEqual(adjustment_set(marked, 'X', 'Y', minimal=True), {'A'})
+        # X - Y is reversible: no set adjusts in both DAGs of the class
+        cpdag = dag_to_cpdag(nx.DiGraph([('X', 'Y'), ('Y', 'W')]))
+        self.assertFalse(is_amenable(cpdag, 'X', 'Y'))
+        self.assertIsNone(adjustment_set(cpdag, 'X', 'Y'))
+        self.assertIsNone(optimal_adjustment_set(cpdag, 'X', 'Y'))
+
     def frontdoor_criterion_search(self):
         self.assertTrue(same_sets(frontdoor_criterion_search(primer['fig3_8'], 'X', 'Y'), [{'W'}]))
+        
+    def test_m_separation(self):
+        G = sp08['fig1']['h']
+        admg = latent_projection(G)
+        observed = sorted(observable_nodes(G))
+        for X, Y in combinations(observed, 2):
+            for Z in powerset(set(observed) - {X, Y}):
+                for H in (admg, admg.freeze()):
+                    self.assertEqual(d_separated(H, X, Y, set(Z)), d_separated(G, X, Y, set(Z)))
+            self.assertTrue(same_sets([separators(admg, X, Y, minimal=True),
+                                       separators(G, X, Y, R=observed, minimal=True)]))
+        
+        confounded = CausalDiagram([('U', 'X'), ('U', 'Y'), ('X', 'Y')])
+        confounded.nodes['U']['hidden'] = True
+        self.assertFalse(meets_backdoor_criterion(latent_projection(confounded), 'X', 'Y', set()))
 
     
 
@@ -176,6 +521,18 @@ class test_identify(unittest.TestCase):
             [True, False, False, True, True, True, False, True]
         )
         
+    def test_has_confounded_path(self):
+        for G in chain(*(figs.values() for figs in sp08.values())):
+            observed = G.nodes - hidden_nodes(G)
+            for X in observed:
+                expected = {Y for Y in observed - {X} 
+                            if any(is_confounded(G, p) for p in paths(G, X, Y))}
+                self.assertEqual(confounded_nodes(G, X), expected)
+                self.assertEqual(expected, {Y for Y in observed - {X} if any(
+                    is_confounded(G.edge_subgraph(p.edges())) for p in paths(G, X, Y))})
+                for Y in observed - {X}:
+                    self.assertEqual(has_confounded_path(G, X, Y), Y in expected)
+        
     def test_c_components(self):
         self.assertEqual(
             [set([frozenset(c) for c in c_components(g)]) for g in sp08['fig2'].values()],
@@ -210,14 +567,233 @@ class test_identify(unittest.TestCase):
             is_identifiable(sp08['fig3']['b'], 'X', {'Y1', 'Y2'})
         )
         
+    def test_identification_estimands(self):
+        # The front-door formula
+        self.assertEqual(str(is_identifiable(sp08['fig2']['e'], 'X', 'Y', estimand=True)),
+                         'Σ_{z} P(z | x) [Σ_{x} P(x) P(y | x,z)]')
+        self.assertEqual(str(is_identifiable(sp08['fig2']['c'], 'X', 'Y', estimand=True)),
+                         'Σ_{z} P(z) P(y | x,z)')
+        hedge = is_identifiable(sp08['fig1']['a'], 'X', 'Y', estimand=True)
+        self.assertIsInstance(hedge, Hedge)
+        self.assertFalse(hedge)
+        self.assertEqual(hedge, Hedge(frozenset({'X', 'Y'}), frozenset({'Y'})))
+        
+        # Subproblems are shared between queries on one diagram
+        ID = Identifier(sp08['fig2']['g'])
+        self.assertTrue(ID.identify('X', 'Y'))
+        solved = len(ID._results)
+        self.assertTrue(ID.identify('X', 'Y'))
+        self.assertEqual(len(ID._results), solved)
+        
+class test_instruments(unittest.TestCase):
+    
+    iv = CausalDiagram([('Z', 'X'), ('X', 'Y'), ('U', 'X'), ('U', 'Y')])
+    conditional_iv = CausalDiagram([('Z', 'X'), ('X', 'Y'), ('U', 'X'), ('U', 'Y'), 
+                                    ('W', 'Z'), ('W', 'Y')])
+    
+    def test_instrumental_variable_search(self):
+        self.assertEqual(instrumental_variable_search(self.iv, 'X', 'Y'), [('Z', [set()])])
+        self.assertEqual(instrumental_variable_search(self.conditional_iv, 'X', 'Y'), 
+                         [('Z', [{'W'}])])
+        self.assertEqual(instrumental_variable_search(sp08['fig1']['a'], 'X', 'Y'), [])
+        
+        # Conditioning on the collider 2 connects 1 to X
+        G = CausalDiagram([('0', '2'), ('0', '3'), ('1', '2'), ('3', '4')])
+        self.assertIn(('1', [{'2'}]), instrumental_variable_search(G, '3', '4', exact=True))
+        
+    def test_instrumental_variable_search_budget(self):
+        # Z is an instrument given A or given B
+        G = CausalDiagram([('Z', 'X'), ('X', 'Y'), ('U', 'X'), ('U', 'Y'), 
+                           ('A', 'Z'), ('A', 'B'), ('B', 'Y')])
+        full = dict(instrumental_variable_search(G, 'X', 'Y'))
+        for Z, Ws in instrumental_variable_search(G, 'X', 'Y', exact=True):
+            self.assertTrue(same_sets([Ws, full[Z]]))
+        partial = False
+        for evaluations in range(1, 20):
+            results = instrumental_variable_search(G, 'X', 'Y', Budget(max_evaluations=evaluations))
+            for Z, Ws in results:
+                self.assertTrue(all(W in full[Z] for W in Ws))
+                # The sets found for Z before the budget ran out are listed
+                partial |= results.truncated and len(Ws) < len(full[Z])
+        self.assertTrue(partial)
+        
+    def test_instrumental_variable_search_brute_force(self):
+        for seed in range(40):
+            G = erdos_renyi_dag(6, degree=2.5, seed=seed)
+            X, Y = sorted(G)[2], sorted(G)[4]
+            found = dict(instrumental_variable_search(G, X, Y, exact=True))
+            for Z in set(G) - {X, Y}:
+                Ws = [set(W) for W in powerset(sorted(set(G) - {X, Y, Z}))
+                      if is_instrumental_variable(G, X, Y, Z, set(W))]
+                self.assertTrue(same_sets([found.get(Z, []), minimal_sets(Ws)]))
+            for Z, Ws in instrumental_variable_search(G, X, Y):
+                self.assertTrue(all(is_instrumental_variable(G, X, Y, Z, W) for W in Ws))
+        
+    def test_ancestral_instrument_search(self):
+        self.assertEqual(ancestral_instrument_search(self.iv, 'X', 'Y'), [('Z', set())])
+        self.assertEqual(ancestral_instrument_search(self.conditional_iv, 'X', 'Y'), 
+                         [('Z', {'W'})])
+        self.assertTrue(is_ancestral_instrument(self.conditional_iv, 'X', 'Y', 'Z', {'W'}))
+        self.assertFalse(is_ancestral_instrument(self.conditional_iv, 'X', 'Y', 'Z'))
+        
+    def test_nearest_separator(self):
+        G = CausalDiagram([('Y', 'A'), ('A', 'B'), ('B', 'Z'), ('U', 'Y'), ('U', 'C'), 
+                           ('C', 'Z')])
+        G.nodes['U']['hidden'] = True
+        self.assertEqual(nearest_separator(G, 'Y', 'Z'), {'A', 'C'})
+        G.add_edge('U', 'Z')
+        self.assertEqual(nearest_separator(G, 'Y', 'Z'), '⊥')
+        
 class test_equivalence(unittest.TestCase):
     
+    def test_dag_to_cpdag(self):
+        self.assertEqual(set(dag_to_cpdag(chickering['fig5']).edges),
+                         {('X', 'Z'), ('Y', 'Z'), ('Z', 'W'), ('Y', 'U'), ('U', 'Y')})
+        self.assertEqual(set(dag_to_cpdag(primer['fig3_8']).edges),
+                         set(primer['fig3_8'].edges) | {('A', 'B'), ('D', 'C')})
+        # Meek's rule 3: a -- b compelled into d by the v-structure b -> d <- c
+        G = CausalDiagram([('A', 'B'), ('A', 'C'), ('A', 'D'), ('B', 'D'), ('C', 'D')])
+        self.assertEqual(set(dag_to_cpdag(G).edges), 
+                         set(G.edges) | {('B', 'A'), ('C', 'A')})
+        
     def test_equivalence_class_size(self):
         self.assertEqual(equivalence_class_size(chickering['fig5']), 2)
         self.assertEqual(equivalence_class_size(primer['fig2_9']), 1)
         self.assertEqual(equivalence_class_size(primer['fig3_7']), 1)
         self.assertEqual(equivalence_class_size(primer['fig3_8']), 4)
         self.assertEqual(equivalence_class_size(bow['fig4_7']), 2)
+        # Chain components that are not trees of independent edges
+        self.assertEqual(equivalence_class_size(CausalDiagram(combinations('ABCD', 2))), 24)
+        self.assertEqual(equivalence_class_size(CausalDiagram(
+            [('A', 'B'), ('B', 'C'), ('C', 'D'), ('D', 'E')])), 5)
+        
+    def test_amo_count(self):
+        self.assertEqual(amo_count(nx.path_graph('ABCD')), 4)
+        self.assertEqual(amo_count(nx.complete_graph('ABCDE')), 120)
+        # Two triangles sharing an edge: 6 + 6 - 2 orientations
+        diamond = nx.Graph([('A', 'B'), ('A', 'C'), ('B', 'C'), ('B', 'D'), ('C', 'D')])
+        self.assertEqual(amo_count(diamond), 10)
+        self.assertEqual(amo_count(nx.relabel_nodes(diamond, str.lower)), 10)
+        
+    def test_equivalent_dags(self):
+        def colliders(D): 
+            return {(c, frozenset(p)) for c, ps in v_structures(D).items() for p in ps}
+        for G in (primer['fig3_8'], chickering['fig5'], CausalDiagram(combinations('ABCD', 2))):
+            cpdag = dag_to_cpdag(G)
+            members = [frozenset(D.edges) for D in equivalent_dags(cpdag)]
+            self.assertEqual(len(members), len(set(members)))
+            self.assertEqual(len(members), equivalence_class_size(G))
+            self.assertIn(frozenset(G.edges), members)
+            for D in map(nx.DiGraph, members):
+                self.assertTrue(nx.is_directed_acyclic_graph(D))
+                self.assertEqual(colliders(D), colliders(G))
+            self.assertIn(frozenset(sample_dag(cpdag).edges), members)
+
+class test_io(unittest.TestCase):
+    
+    def test_io(self):
+        G = from_dagitty('''dag { bb="0,0,1,1"
+                                  U [latent] X [exposure]
+                                  U -> X U -> Y {A B} -> X -> M -> Y Z <-> Y }''')
+        self.assertEqual(set(G.edges), {('U', 'X'), ('U', 'Y'), ('A', 'X'), ('B', 'X'), ('X', 'M'), 
+                                        ('M', 'Y'), ('U_Y_Z', 'Y'), ('U_Y_Z', 'Z')})
+        self.assertEqual(hidden_nodes(G), {'U', 'U_Y_Z'})
+        cpdag = from_dagitty('pdag { A -- B -> C }')
+        self.assertEqual(set(cpdag.edges), {('A', 'B'), ('B', 'A'), ('B', 'C')})
+        self.assertEqual(set(from_dot('digraph G { subgraph cluster_0 { A -> B } B -> C }').edges),
+                         {('A', 'B'), ('B', 'C')})
+        self.assertEqual(set(from_dot('digraph { subgraph { A B } -> C {rank=same; D} }').edges),
+                         {('A', 'C'), ('B', 'C')})
+        
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'G')
+            write_csv(G, path)
+            write_binary(latent_projection(sp08['fig1']['d']), path + '.bin')
+            for H in (from_dagitty(to_dagitty(G)), from_dot(to_dot(G)), read_csv(path)):
+                self.assertEqual(set(H.edges), set(G.edges))
+                self.assertEqual(hidden_nodes(H), hidden_nodes(G))
+            self.assertEqual(set(from_dagitty(to_dagitty(cpdag)).edges), set(cpdag.edges))
+            
+            admg = read_binary(path + '.bin')
+            self.assertEqual(set(admg.edges), {('X', 'Y'), ('Z', 'Y')})
+            self.assertEqual({frozenset(e) for e in bidirected_edges(admg)},
+                             {frozenset({'X', 'Z'}), frozenset({'Y', 'Z'})})
+            self.assertEqual(c_components(admg), [{'X', 'Y', 'Z'}])
+            del admg # Release the memory-mapped file
+
+class test_profiling(unittest.TestCase):
+    
+    def test_profiling(self):
+        G = bow['fig4_7']
+        with profile() as p:
+            adjusters(G, 'X', 'Y')
+            with profile() as inner:
+                is_identifiable(sp08['fig2']['e'], 'X', 'Y')
+        functions, events = p.as_dict()['functions'], p.as_dict()['events']
+        self.assertEqual(functions['is_identifiable']['calls'], 1)
+        self.assertGreater(functions['d_separated']['calls'], 0)
+        self.assertLessEqual(functions['separators']['self_seconds'], functions['separators']['seconds'])
+        self.assertEqual(events['adjusters']['subsets examined'], events['']['subsets examined'])
+        self.assertEqual(events['is_identifiable'], inner.as_dict()['events']['is_identifiable'])
+        self.assertIn('ID line 1', events['is_identifiable'])
+        self.assertEqual(json.loads(p.to_json()), json.loads(json.dumps(p.as_dict())))
+        with tempfile.TemporaryDirectory() as directory:
+            p.dump_stats(os.path.join(directory, 'oyster.prof'))
+            stats = pstats.Stats(os.path.join(directory, 'oyster.prof')).stats
+            self.assertEqual({label[2] for label in stats}, 
+                             {name.split('.')[-1] for name in functions})
+        
+        with profile() as p: pass
+        adjusters(G, 'X', 'Y') # Not recorded once the profile is closed
+        self.assertEqual(p.as_dict(), {'functions': {}, 'events': {}})
+        
+    def test_lazy_imports(self):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(oyster.__file__)))
+        heavy = ('matplotlib', 'oyster.viz.viz', 'oyster.example.graphs')
+        code = f'import sys, oyster; print([m for m in {heavy} if m in sys.modules])'
+        loaded = subprocess.run([sys.executable, '-c', code], cwd=root, 
+                                stdout=subprocess.PIPE, universal_newlines=True).stdout
+        self.assertEqual(loaded.strip(), '[]')
+        self.assertIs(oyster.draw, oyster.viz.viz.draw)
+        self.assertEqual(oyster.P('y', do='x'), 'P_{x}(y)')
+        self.assertIs(oyster.product, oyster.viz.formulas.product)
+
+class test_benchmarks(unittest.TestCase):
+    
+    def test_benchmarks(self):
+        for name, generator in GENERATORS.items():
+            G = generator(200, seed=1)
+            self.assertTrue(nx.is_directed_acyclic_graph(G))
+            self.assertEqual(len(observable_nodes(G)), 200)
+            self.assertEqual(set(G.edges), set(generator(200, seed=1).edges))
+        self.assertEqual(hidden_nodes(confounded_dag(100, latents=5)), {f'U{i}' for i in range(5)})
+        for base, parameters in ((erdos_renyi_dag, {'degree': 3.0}), (scale_free_dag, {'m': 3}),
+                                 (layered_dag, {'layers': 4, 'degree': 3})):
+            G = confounded_dag(50, latents=5, seed=2, base=base, **parameters)
+            self.assertEqual(G.subgraph(observable_nodes(G)).edges, 
+                             base(50, seed=2, **parameters).edges)
+            self.assertEqual(len(hidden_nodes(G)), 5)
+        results = run(['d_separated', 'c_components'], ['layered'], sizes=(10, 20), 
+                      repeat=1, memory=False, log=None)
+        self.assertEqual([r['status'] for r in results], ['ok'] * 4)
+
+class test_batch(unittest.TestCase):
+    
+    def test_batch_analysis(self):
+        G = sp08['fig2']['e']
+        queries = pair_queries(G, ('identifiable', 'minimal_adjustment_sets'))
+        answers = dict(analyze(G, queries, processes=2))
+        self.assertEqual(set(answers), set(queries))
+        self.assertEqual(answers, dict(analyze(G, queries, processes=0)))
+        for (kind, X, Y), answer in answers.items():
+            if kind == 'identifiable': 
+                self.assertEqual(answer, is_identifiable(G, X, Y))
+            else: 
+                self.assertEqual(answer, minimal_adjustment_sets(G, X, Y))
+        self.assertEqual(dict(analyze(G, [('identifiable', 'X', 'Y')], processes=0)),
+                         {Query('identifiable', 'X', 'Y'): True})
+        with self.assertRaises(ValueError): # Before any process starts
+            analyze(G, [('identifiable', 'X', 'Y'), ('unknown', 'X', 'Y')], processes=2)
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file